@@ -0,0 +1,79 @@
+from sqlalchemy import insert
+import settings
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# What an item field may hold: (check, description used in the error message)
+STRING = (lambda value: isinstance(value, str) and value != '', 'a non-empty string')
+ANY_STRING = (lambda value: isinstance(value, str), 'a string')
+TEXT = (lambda value: value is None or isinstance(value, str), 'a string')
+AMOUNT = (_is_number, 'a non-negative number')
+COUNT = (lambda value: _is_integer(value) and value >= 0, 'a non-negative integer')
+QUANTITY = (lambda value: _is_integer(value) and value >= 1, 'a positive integer')
+ID = (_is_integer, 'an integer id')
+
+
+def validate_items(items, required, optional=None, max_items=None):
+    """Check a bulk request and every item in it.
+
+    required and optional map field names to one of the field kinds above. Returns
+    (error, item_errors): error describes a request that isn't a usable array at all, and
+    item_errors lists {'index', 'error'} for every bad item, empty when all of them are usable.
+    max_items defaults to BULK_MAX_ITEMS.
+    """
+    max_items = max_items or settings.BULK_MAX_ITEMS
+    if not isinstance(items, list) or not items:
+        return 'Expected a non-empty JSON array of items', []
+    if len(items) > max_items:
+        return f'At most {max_items} items can be created per request', []
+
+    item_errors = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            item_errors.append({'index': index, 'error': 'not an object'})
+            continue
+        problems = []
+        missing = [name for name in required if name not in item]
+        if missing:
+            problems.append(f"missing {', '.join(missing)}")
+        for name, (check, description) in {**required, **(optional or {})}.items():
+            if name in item and not check(item[name]):
+                problems.append(f'{name} must be {description}')
+        if problems:
+            item_errors.append({'index': index, 'error': '; '.join(problems)})
+
+    return None, item_errors
+
+
+def invalid_items(item_errors):
+    """The message summing up a rejected bulk request."""
+    count = len(item_errors)
+    return f"{count} item{'s' if count > 1 else ''} rejected, nothing was created"
+
+
+def batches(values, batch_size=None):
+    """Split values into lists of at most batch_size, e.g. to keep IN (...) under SQLite's parameter limit."""
+    values = list(values)
+    batch_size = batch_size or settings.BULK_BATCH_SIZE
+    return [values[start:start + batch_size] for start in range(0, len(values), batch_size)]
+
+
+def insert_rows(session, model, rows, batch_size=None):
+    """Insert rows with one multi-row INSERT ... RETURNING per batch and return their ids in order.
+
+    Column defaults such as created_at are applied as for single inserts, but no ORM objects
+    are built, refreshed or tracked by the session.
+    """
+    statement = insert(model).returning(model.id, sort_by_parameter_order=True)
+
+    ids = []
+    for batch in batches(rows, batch_size):
+        ids.extend(session.scalars(statement, batch))
+    return ids
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from multiprocessing import Lock, RawValue
+import threading
+import time
+
+# Every cache created through LRUCache, by name, so their counters can be reported together
+caches = {}
+
+
+class LRUCache:
+    """Thread-safe in-process cache with a size bound, LRU eviction and an optional TTL.
+
+    Entries are loaded through get_or_load(), which counts hits and misses. A value loaded
+    while an invalidation happened is handed back to the caller but not stored, so a read
+    racing with an update can't put the stale row back into the cache.
+
+    Processes forked after the cache is created (see web/prefork.py) each hold their own
+    entries but share an invalidation counter. An invalidation in one process empties the
+    cache in every other process on its next lookup. This is coarser than dropping one key,
+    but it never serves a row another process has changed.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl or None
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._invalidations = 0
+        self._lock = threading.Lock()
+        # Shared memory, inherited by forked processes. Lookups read it without a lock; an aligned
+        # 8-byte read is never torn and only has to notice that the value changed. The
+        # cross-process lock only makes concurrent increments from _publish() add up.
+        self._generation = RawValue('Q', 0)
+        self._generation_lock = Lock()
+        self._seen_generation = 0
+        caches[name] = self
+
+    def get_or_load(self, key, load):
+        """Return the cached value for key, calling load() on a miss.
+
+        load() returns None for values that must not be cached, such as missing rows.
+        """
+        with self._lock:
+            self._catch_up()
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            invalidations = self._invalidations
+
+        value = load()
+        if value is None or self.maxsize <= 0:
+            return value
+
+        with self._lock:
+            self._catch_up()
+            if invalidations == self._invalidations:
+                expires_at = self._clock() + self.ttl if self.ttl else None
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._invalidations += 1
+            self._publish()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._invalidations += 1
+            self._publish()
+
+    def _catch_up(self):
+        # Another process invalidated something since this one last looked
+        generation = self._generation.value
+        if generation != self._seen_generation:
+            self._entries.clear()
+            self._invalidations += 1
+            self._seen_generation = generation
+
+    def _publish(self):
+        with self._generation_lock:
+            previous = self._generation.value
+            self._generation.value = previous + 1
+        # Only skip our own bump; if someone else's came in between, the next lookup clears
+        if previous == self._seen_generation:
+            self._seen_generation = previous + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
@@ -1,100 +1,162 @@
-from db.session import SessionFactory
+from sqlalchemy import select
+from db.aggregates import add_to_product_stats
+from db.group_commit import batched
+from db.session import Session
 from db.models import OrderDetails, Order, Product
+from api.bulk import ID, QUANTITY, validate_items, invalid_items, insert_rows, batches
+from api.pagination import parse_page, fetch_page
+from api.serializers import serializers
 from http import HTTPStatus
-import json
+
+serialize_order_detail = serializers[OrderDetails]
 
 
 def get_order_detail(order_detail_id):
     """Retrieve details for a specific order detail item."""
-    session = SessionFactory()
-    order_detail = session.query(OrderDetails).filter_by(id=order_detail_id).first()
-    session.close()
+    data = serialize_order_detail.fetch_by_id(Session(), order_detail_id)
 
-    if not order_detail:
-        return HTTPStatus.NOT_FOUND, json.dumps({'error': 'OrderDetail not found'})
+    if not data:
+        return {'error': 'OrderDetail not found'}, HTTPStatus.NOT_FOUND
+
+    return data, HTTPStatus.OK
 
-    data = {
-        'id': order_detail.id,
-        'order_id': order_detail.order_id,
-        'product_id': order_detail.product_id,
-        'quantity': order_detail.quantity,
-        'sub_total': order_detail.sub_total
-    }
 
-    return HTTPStatus.OK, json.dumps(data)
+def list_order_details(query):
+    """List order detail items a page at a time, optionally for one order or product."""
+    page, error = parse_page(query, {'order_id': int, 'product_id': int})
+    if error:
+        return {'error': error}, HTTPStatus.BAD_REQUEST
+    if page.order_by != 'id':
+        return {'error': 'Order details can only be ordered by id'}, HTTPStatus.BAD_REQUEST
 
+    conditions = [getattr(OrderDetails, name) == value for name, value in page.filters.items()]
+    return fetch_page(Session(), serialize_order_detail, page, *conditions), HTTPStatus.OK
 
+
+@batched
 def create_order_detail(order_id, product_id, quantity):
     """Create a new order detail item."""
-    session = SessionFactory()
+    error = _check_quantity(quantity)
+    if error:
+        return error
+
+    session = Session()
 
     # Check if order and product exist
     order = session.query(Order).filter_by(id=order_id).first()
     product = session.query(Product).filter_by(id=product_id).first()
 
     if not order or not product:
-        session.close()
-        return HTTPStatus.BAD_REQUEST, json.dumps({'error': 'Invalid order or product ID'})
+        return {'error': 'Invalid order or product ID'}, HTTPStatus.BAD_REQUEST
 
     sub_total = product.price * quantity
     order_detail = OrderDetails(order_id=order_id, product_id=product_id, quantity=quantity, sub_total=sub_total)
 
     session.add(order_detail)
-    session.commit()
-
-    data = {
-        'id': order_detail.id,
-        'order_id': order_detail.order_id,
-        'product_id': order_detail.product_id,
-        'quantity': order_detail.quantity,
-        'sub_total': order_detail.sub_total
-    }
-
-    session.close()
-
-    return HTTPStatus.CREATED, json.dumps(data)
+    session.flush()
+    add_to_product_stats(session, product_id, quantity, sub_total)
+
+    data = serialize_order_detail(order_detail)
+
+    return data, HTTPStatus.CREATED
+
+
+def bulk_create_order_details(items):
+    """Create many order detail items in one transaction, or none of them, reporting every rejected item."""
+    error, item_errors = validate_items(items, {'order_id': ID, 'product_id': ID, 'quantity': QUANTITY})
+    if error:
+        return {'error': error}, HTTPStatus.BAD_REQUEST
+    malformed = {item_error['index'] for item_error in item_errors}
+    usable = [(index, item) for index, item in enumerate(items) if index not in malformed]
+
+    session = Session()
+
+    # Look up every referenced order and product price once instead of once per item
+    order_ids = {item['order_id'] for _, item in usable}
+    product_ids = {item['product_id'] for _, item in usable}
+    found_order_ids = set()
+    for batch in batches(order_ids):
+        found_order_ids.update(session.scalars(select(Order.id).where(Order.id.in_(batch))))
+    prices = {}
+    for batch in batches(product_ids):
+        prices.update(session.execute(select(Product.id, Product.price).where(Product.id.in_(batch))).all())
+
+    for index, item in usable:
+        problems = []
+        if item['order_id'] not in found_order_ids:
+            problems.append(f"order {item['order_id']} not found")
+        if item['product_id'] not in prices:
+            problems.append(f"product {item['product_id']} not found")
+        if problems:
+            item_errors.append({'index': index, 'error': '; '.join(problems)})
+    if item_errors:
+        item_errors.sort(key=lambda item_error: item_error['index'])
+        return {'error': invalid_items(item_errors), 'errors': item_errors}, HTTPStatus.BAD_REQUEST
+
+    rows = [{
+        'order_id': item['order_id'],
+        'product_id': item['product_id'],
+        'quantity': item['quantity'],
+        'sub_total': prices[item['product_id']] * item['quantity']
+    } for item in items]
+
+    order_detail_ids = insert_rows(session, OrderDetails, rows)
+
+    sales = {}
+    for row in rows:
+        units, revenue = sales.get(row['product_id'], (0, 0.0))
+        sales[row['product_id']] = units + row['quantity'], revenue + row['sub_total']
+    for product_id, (units, revenue) in sales.items():
+        add_to_product_stats(session, product_id, units, revenue)
+
+    return {'ids': order_detail_ids, 'count': len(order_detail_ids)}, HTTPStatus.CREATED
 
 
 def update_order_detail(order_detail_id, quantity=None):
     """Update a specific order detail item."""
-    session = SessionFactory()
+    error = quantity is not None and _check_quantity(quantity)
+    if error:
+        return error
+
+    session = Session()
     order_detail = session.query(OrderDetails).filter_by(id=order_detail_id).first()
 
     if not order_detail:
-        session.close()
-        return HTTPStatus.NOT_FOUND, json.dumps({'error': 'OrderDetail not found'})
+        return {'error': 'OrderDetail not found'}, HTTPStatus.NOT_FOUND
 
-    if quantity:
-        order_detail.quantity = quantity
+    if quantity is not None:
         product = session.query(Product).filter_by(id=order_detail.product_id).first()
-        order_detail.sub_total = product.price * quantity
+        sub_total = product.price * quantity
+        add_to_product_stats(session, order_detail.product_id, quantity - order_detail.quantity,
+                             sub_total - order_detail.sub_total)
+        order_detail.quantity = quantity
+        order_detail.sub_total = sub_total
+
+    session.flush()
 
-    session.commit()
+    data = serialize_order_detail(order_detail)
 
-    data = {
-        'id': order_detail.id,
-        'order_id': order_detail.order_id,
-        'product_id': order_detail.product_id,
-        'quantity': order_detail.quantity,
-        'sub_total': order_detail.sub_total
-    }
+    return data, HTTPStatus.OK
 
-    session.close()
 
-    return HTTPStatus.OK, json.dumps(data)
+def _check_quantity(quantity):
+    # A zero, negative or fractional quantity would corrupt sub_total and the product's sales
+    check, description = QUANTITY
+    if not check(quantity):
+        return {'error': f'quantity must be {description}'}, HTTPStatus.BAD_REQUEST
+    return None
 
 
 def delete_order_detail(order_detail_id):
     """Delete a specific order detail item."""
-    session = SessionFactory()
+    session = Session()
     order_detail = session.query(OrderDetails).filter_by(id=order_detail_id).first()
 
     if not order_detail:
-        session.close()
-        return HTTPStatus.NOT_FOUND, json.dumps({'error': 'OrderDetail not found'})
+        return {'error': 'OrderDetail not found'}, HTTPStatus.NOT_FOUND
 
     session.delete(order_detail)
-    session.commit()
-    session.close()
+    session.flush()
+    add_to_product_stats(session, order_detail.product_id, -order_detail.quantity, -order_detail.sub_total)
 
-    return HTTPStatus.NO_CONTENT, json.dumps({'message': 'OrderDetail successfully deleted'})
+    return {'message': 'OrderDetail successfully deleted'}, HTTPStatus.OK
@@ -1,56 +1,189 @@
-from db.models import Order, User
-from db.session import SessionFactory
+from sqlalchemy import select, update
+from sqlalchemy.orm import selectinload
+from db.aggregates import add_to_user_stats, add_to_product_stats
+from db.models import Order, OrderDetails, Product, User
+from db.group_commit import batched
+from db.session import Session, after_commit
+from api.bulk import insert_rows
+from api.order_details_routes import serialize_order_detail
+from api.pagination import parse_page, fetch_page
+from api.product_routes import serialize_product, product_cache
+from api.serializers import serializers
+
+serialize_order = serializers[Order]
+
+# Related data that can be embedded in an order with ?expand=, and the eager load fetching it.
+# Each selectinload adds exactly one query, however many order details there are.
+EXPANSIONS = {
+    'order_details': selectinload(Order.order_details),
+    'order_details.product': selectinload(Order.order_details).selectinload(OrderDetails.product),
+}
+
+
+def list_orders(query):
+    """List orders a page at a time, optionally for a single user."""
+    page, error = parse_page(query, {'user_id': int})
+    if error:
+        return {'error': error}, 400
+
+    conditions = []
+    if 'user_id' in page.filters:
+        conditions.append(Order.user_id == page.filters['user_id'])
+
+    return fetch_page(Session(), serialize_order, page, *conditions), 200
+
+
+def get_order(order_id, expand=()):
+    """Retrieve a specific order by its ID, with any related data named in expand."""
+    unknown = [name for name in expand if name not in EXPANSIONS]
+    if unknown:
+        return {'error': f"Cannot expand {', '.join(unknown)}"}, 400
+
+    if not expand:
+        order_data = serialize_order.fetch_by_id(Session(), order_id)
+        if not order_data:
+            return {'error': 'Order not found'}, 404
+        return order_data, 200
+
+    order = (Session().query(Order)
+             .options(*(EXPANSIONS[name] for name in expand))
+             .filter(Order.id == order_id)
+             .first())
 
-# Create a session
-session = SessionFactory()
-
-
-def get_all_orders():
-    """Retrieve all orders."""
-    return session.query(Order).all()
+    if not order:
+        return {'error': 'Order not found'}, 404
 
+    order_data = serialize_order(order)
+    with_products = 'order_details.product' in expand
+    order_data['order_details'] = []
+    for order_detail in order.order_details:
+        order_detail_data = serialize_order_detail(order_detail)
+        if with_products:
+            order_detail_data['product'] = serialize_product(order_detail.product)
+        order_data['order_details'].append(order_detail_data)
 
-def get_order(order_id):
-    """Retrieve a specific order by its ID."""
-    return session.query(Order).filter(Order.id == order_id).first()
+    return order_data, 200
 
 
+@batched
 def create_order(user_id, total):
     """Create a new order for a user."""
+    session = Session()
     user = session.query(User).filter(User.id == user_id).first()
 
     if not user:
-        return "User not found", 404
+        return {'error': 'User not found'}, 404
 
     order = Order(user_id=user_id, total=total)
     session.add(order)
-    session.commit()
+    session.flush()
+    add_to_user_stats(session, user_id, 1, total)
+
+    return serialize_order(order), 201
+
+
+def checkout(user_id, items):
+    """Place an order in one transaction: reserve stock, price every line and write the order with its details.
+
+    Prices and the total are computed here, never taken from the client. Stock is taken with a
+    conditional UPDATE ... WHERE stock >= quantity that also returns the price, so concurrent
+    checkouts can't oversell and no row is read before it is written. Any failure rolls back
+    the whole checkout.
+    """
+    if not isinstance(user_id, int) or isinstance(user_id, bool):
+        return {'error': 'user_id must be an integer'}, 400
+    if not isinstance(items, list) or not items:
+        return {'error': 'Expected a non-empty list of items'}, 400
+
+    quantities = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or 'product_id' not in item or 'quantity' not in item:
+            return {'error': f'Item {index} needs a product_id and a quantity'}, 400
+        product_id = item['product_id']
+        if not isinstance(product_id, int) or isinstance(product_id, bool):
+            return {'error': f'Item {index} has an invalid product_id'}, 400
+        quantity = item['quantity']
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            return {'error': f'Item {index} has an invalid quantity'}, 400
+        # Lines for the same product are merged into one
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    session = Session()
+    if session.scalar(select(User.id).where(User.id == user_id)) is None:
+        return {'error': 'User not found'}, 404
+
+    sub_totals = {}
+    for product_id, quantity in quantities.items():
+        price = session.scalar(
+            update(Product)
+            .where(Product.id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity, version=Product.version + 1)
+            .returning(Product.price)
+            .execution_options(synchronize_session=False)
+        )
+        if price is None:
+            if session.scalar(select(Product.id).where(Product.id == product_id)) is None:
+                return {'error': f'Product {product_id} not found'}, 404
+            return {'error': f'Not enough stock for product {product_id}'}, 409
+        sub_totals[product_id] = price * quantity
+
+    order = Order(user_id=user_id, total=sum(sub_totals.values()))
+    session.add(order)
+    session.flush()
+
+    rows = [{
+        'order_id': order.id,
+        'product_id': product_id,
+        'quantity': quantities[product_id],
+        'sub_total': sub_total
+    } for product_id, sub_total in sub_totals.items()]
+    insert_rows(session, OrderDetails, rows)
+    add_to_user_stats(session, user_id, 1, order.total)
+    for product_id, sub_total in sub_totals.items():
+        add_to_product_stats(session, product_id, quantities[product_id], sub_total)
+
+    def invalidate_products():
+        # Cached products still show the stock from before the checkout
+        for product_id in quantities:
+            product_cache.invalidate(product_id)
+
+    after_commit(invalidate_products)
 
-    return order
+    order_data = serialize_order(order)
+    order_data['order_details'] = [serialize_order_detail.from_row(row) for row in session.execute(
+        serialize_order_detail.select().where(OrderDetails.order_id == order.id).order_by(OrderDetails.id))]
+    return order_data, 201
 
 
 def update_order(order_id, total=None):
     """Update the total amount of an order by its ID."""
+    session = Session()
     order = session.query(Order).filter(Order.id == order_id).first()
 
     if not order:
-        return "Order not found", 404
+        return {'error': 'Order not found'}, 404
 
     if total:
+        add_to_user_stats(session, order.user_id, 0, total - order.total)
         order.total = total
-        session.commit()
+        session.flush()
 
-    return order
+    return serialize_order(order), 200
 
 
 def delete_order(order_id):
     """Delete an order by its ID."""
+    session = Session()
     order = session.query(Order).filter(Order.id == order_id).first()
 
     if not order:
-        return "Order not found", 404
+        return {'error': 'Order not found'}, 404
 
+    # The order's details are deleted with it, and so are their sales
+    for order_detail in order.order_details:
+        add_to_product_stats(session, order_detail.product_id, -order_detail.quantity, -order_detail.sub_total)
     session.delete(order)
-    session.commit()
+    session.flush()
+    add_to_user_stats(session, order.user_id, -1, -order.total)
 
-    return "Order deleted successfully", 200
+    return {'message': 'Order deleted successfully'}, 200
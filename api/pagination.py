@@ -0,0 +1,135 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+import settings
+
+ORDERINGS = ('id', 'created_at')
+
+
+class Page:
+    """Parsed paging arguments for a list endpoint."""
+
+    __slots__ = ('limit', 'order_by', 'after', 'filters')
+
+    def __init__(self, limit, order_by, after, filters):
+        self.limit = limit
+        self.order_by = order_by
+        # (created_at, id) or (id,) of the last row on the previous page, None for the first page
+        self.after = after
+        self.filters = filters
+
+
+def parse_page(query, filters=None, orderings=ORDERINGS):
+    """Read limit, order_by, cursor and the allowed filters from a parsed query string.
+
+    filters maps each accepted filter name to a function converting its raw value, and
+    orderings lists the accepted order_by values, the first being the default.
+    Returns (Page, None), or (None, error message) when an argument is malformed.
+    """
+    def first(name):
+        values = query.get(name)
+        return values[0] if values else None
+
+    try:
+        limit = int(first('limit') or settings.PAGE_SIZE_DEFAULT)
+    except ValueError:
+        return None, 'limit must be an integer'
+    if limit < 1:
+        return None, 'limit must be at least 1'
+    limit = min(limit, settings.PAGE_SIZE_MAX)
+
+    order_by = first('order_by') or orderings[0]
+    if order_by not in orderings:
+        return None, f"order_by must be one of {', '.join(orderings)}"
+
+    after = None
+    cursor = first('cursor')
+    if cursor:
+        after = decode_cursor(cursor, order_by)
+        if after is None:
+            return None, 'cursor is invalid'
+
+    parsed_filters = {}
+    for name, convert in (filters or {}).items():
+        value = first(name)
+        if value is None:
+            continue
+        try:
+            parsed_filters[name] = convert(value)
+        except ValueError:
+            return None, f'{name} is invalid'
+
+    return Page(limit, order_by, after, parsed_filters), None
+
+
+def fetch_page(session, serializer, page, *conditions, statement=None):
+    """Serialize one page of rows matching conditions, continuing after the cursor instead of using OFFSET.
+
+    The keyset condition and ORDER BY match the primary key or the (created_at, id) index,
+    so each page costs the same however deep into the table it is. Rows are read as plain
+    column tuples; no ORM objects are built. statement replaces serializer.select(), e.g. to
+    join another table; ordering by 'rank' needs it to select a column labelled rank.
+    """
+    model = serializer.model
+    statement = (serializer.select() if statement is None else statement).where(*conditions)
+
+    if page.order_by == 'rank':
+        rank = statement.selected_columns.rank
+        order_columns = (rank, model.id)
+        if page.after is not None:
+            after_rank, row_id = page.after
+            statement = statement.where(or_(rank > after_rank, and_(rank == after_rank, model.id > row_id)))
+    elif page.order_by == 'created_at':
+        order_columns = (model.created_at, model.id)
+        if page.after is not None:
+            created_at, row_id = page.after
+            statement = statement.where(or_(model.created_at > created_at,
+                                            and_(model.created_at == created_at, model.id > row_id)))
+    else:
+        order_columns = (model.id,)
+        if page.after is not None:
+            statement = statement.where(model.id > page.after[0])
+
+    # One extra row tells whether there is a next page
+    rows = session.execute(statement.order_by(*order_columns).limit(page.limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor(rows[-1], page.order_by)
+
+    return {'items': [serializer.from_row(row) for row in rows], 'next_cursor': next_cursor}
+
+
+def encode_cursor(row, order_by):
+    if order_by == 'rank':
+        key = [row.rank, row.id]
+    elif order_by == 'created_at':
+        key = [row.created_at.isoformat(), row.id]
+    else:
+        key = [row.id]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order_by):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if order_by == 'rank':
+            rank, row_id = key
+            return float(rank), int(row_id)
+        if order_by == 'created_at':
+            created_at, row_id = key
+            return datetime.fromisoformat(created_at), int(row_id)
+        (row_id,) = key
+        return (int(row_id),)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
@@ -0,0 +1,133 @@
+"""Password hashing with scrypt, run in a bounded pool of worker processes.
+
+A single hash takes tens of milliseconds of pure CPU at the default cost. Run on a request
+thread it would hold the GIL for all of that time and stall every other request in the
+process, so the work goes to separate processes and the request thread just waits for the
+result. At most PASSWORD_HASH_MAX_PENDING jobs are accepted at once; beyond that callers get
+PasswordHasherBusy, which the dispatcher answers with a 503, rather than tying up more
+request threads. Time spent per operation, including the wait for a worker, is recorded as
+the password_hash_seconds histogram at GET /metrics.
+
+Hashes are stored as scrypt$N$r$p$salt$key with base64 salt and key, so the cost can be
+raised later without invalidating existing hashes; see needs_rehash().
+"""
+import base64
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+import settings
+from web.metrics import metrics
+
+SCHEME = 'scrypt'
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+metrics.describe('password_hash_seconds', 'Time to hash or verify passwords, including the wait for a worker.')
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(settings.PASSWORD_HASH_MAX_PENDING)
+
+
+class PasswordHasherBusy(Exception):
+    """Every password hashing slot is taken; the client should retry shortly."""
+
+
+def hash_password(password):
+    """Return the encoded scrypt hash of password at the configured cost."""
+    return _run('hash', _hash, [(password, *_cost())])[0]
+
+
+def hash_passwords(passwords):
+    """Hash many passwords, in the order given, spread over every worker but taking a single slot."""
+    passwords = list(passwords)
+    size = -(-len(passwords) // max(settings.PASSWORD_HASH_WORKERS, 1)) or 1
+    chunks = [(passwords[start:start + size], *_cost()) for start in range(0, len(passwords), size)]
+    return [encoded for hashed in _run('hash', _hash_many, chunks) for encoded in hashed]
+
+
+def verify_password(password, encoded):
+    """Whether password matches an encoded hash, compared in constant time."""
+    return _run('verify', _verify, [(password, encoded)])[0]
+
+
+def needs_rehash(encoded):
+    """Whether a stored hash predates the current cost parameters, or isn't hashed at all."""
+    scheme, _, parameters = encoded.partition('$')
+    return scheme != SCHEME or parameters.split('$')[:3] != [str(value) for value in _cost()]
+
+
+def _cost():
+    return settings.PASSWORD_HASH_N, settings.PASSWORD_HASH_R, settings.PASSWORD_HASH_P
+
+
+def _run(operation, function, calls):
+    """Return function(*args) for each args in calls, computed in the pool, as one pending job."""
+    if not _pending.acquire(blocking=False):
+        raise PasswordHasherBusy()
+
+    started = time.perf_counter()
+    try:
+        if settings.PASSWORD_HASH_WORKERS <= 0:
+            return [function(*args) for args in calls]
+        futures = [_executor().submit(function, *args) for args in calls]
+        return [future.result() for future in futures]
+    finally:
+        _pending.release()
+        metrics.observe('password_hash_seconds', time.perf_counter() - started, operation=operation)
+
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Fresh interpreters rather than forks, which would copy the request threads' locks
+            _pool = ProcessPoolExecutor(settings.PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _forget_pool():
+    # A forked child can't use its parent's pool; it starts its own on first use
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
+
+
+# The functions below run in the worker processes
+
+def _derive(password, salt, n, r, p):
+    # scrypt needs 128 * r * (N + p + 2) bytes; allow that plus some headroom over OpenSSL's 32 MiB default
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024)
+
+
+def _hash(password, n, r, p):
+    salt = os.urandom(SALT_BYTES)
+    key = _derive(password, salt, n, r, p)
+    return '$'.join((SCHEME, str(n), str(r), str(p), base64.b64encode(salt).decode(), base64.b64encode(key).decode()))
+
+
+def _hash_many(passwords, n, r, p):
+    return [_hash(password, n, r, p) for password in passwords]
+
+
+def _verify(password, encoded):
+    scheme, _, rest = encoded.partition('$')
+    if scheme != SCHEME:
+        # Stored before hashing was introduced
+        return hmac.compare_digest(password.encode(), encoded.encode())
+
+    try:
+        n, r, p, salt, key = rest.split('$')
+        expected = base64.b64decode(key)
+        actual = _derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
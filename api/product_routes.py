@@ -1,32 +1,84 @@
-from db.models import Product
-from db.session import SessionFactory
-import json
+from sqlalchemy import select
+from db.aggregates import product_stats
+from db.models import OrderDetails, Product
+from db.search import match, products_fts
+from db.session import Session, after_commit, read_from_primary
+from api.bulk import STRING, TEXT, AMOUNT, COUNT, validate_items, invalid_items, insert_rows
+from api.cache import LRUCache
+from api.pagination import parse_page, fetch_page, parse_bool
+from api.serializers import serializers
+import settings
+
+product_cache = LRUCache('products', settings.CACHE_SIZE, settings.CACHE_TTL)
+serialize_product = serializers[Product]
 
 
 def get_product(product_id):
     """Retrieve a product based on its ID."""
-    session = SessionFactory()
-    product = session.query(Product).filter(Product.id == product_id).one_or_none()
+    product_data = product_cache.get_or_load(product_id, lambda: _load_product(product_id))
 
-    if not product:
+    if not product_data:
         return {'error': 'Product not found'}, 404
 
-    product_data = {
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'price': product.price,
-        'stock': product.stock,
-        'created_at': product.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    }
-
-    session.close()
     return product_data, 200
 
 
+def _load_product(product_id):
+    # A lagging replica could put a stale copy in the cache for the whole TTL
+    read_from_primary()
+    return serialize_product.fetch_by_id(Session(), product_id)
+
+
+def get_product_stats(product_id):
+    """Retrieve the units sold and revenue of a product."""
+    stats = product_stats(Session(), product_id)
+
+    if not stats:
+        return {'error': 'Product not found'}, 404
+
+    return stats, 200
+
+
+def list_products(query):
+    """List products a page at a time, optionally only those in or out of stock."""
+    page, error = parse_page(query, {'in_stock': parse_bool})
+    if error:
+        return {'error': error}, 400
+
+    conditions = []
+    if 'in_stock' in page.filters:
+        conditions.append(Product.stock > 0 if page.filters['in_stock'] else Product.stock <= 0)
+
+    return fetch_page(Session(), serialize_product, page, *conditions), 200
+
+
+def search_products(query):
+    """Full-text search over product names and descriptions, best matches first, a page at a time."""
+    condition = match(query['q'][0]) if query.get('q') else None
+    if condition is None:
+        return {'error': 'q must contain at least one word'}, 400
+
+    page, error = parse_page(query, {'min_price': float, 'max_price': float, 'in_stock': parse_bool}, ('rank',))
+    if error:
+        return {'error': error}, 400
+
+    conditions = [condition]
+    if 'min_price' in page.filters:
+        conditions.append(Product.price >= page.filters['min_price'])
+    if 'max_price' in page.filters:
+        conditions.append(Product.price <= page.filters['max_price'])
+    if 'in_stock' in page.filters:
+        conditions.append(Product.stock > 0 if page.filters['in_stock'] else Product.stock <= 0)
+
+    # The FTS index finds and ranks the matches, then each is joined to its product by primary key
+    statement = (serialize_product.select().add_columns(products_fts.c.rank.label('rank'))
+                 .select_from(products_fts.join(Product, Product.id == products_fts.c.rowid)))
+    return fetch_page(Session(), serialize_product, page, *conditions, statement=statement), 200
+
+
 def create_product(data):
     """Add a new product."""
-    session = SessionFactory()
+    session = Session()
 
     new_product = Product(
         name=data['name'],
@@ -37,29 +89,41 @@ def create_product(data):
     )
 
     session.add(new_product)
-    session.commit()
-    session.refresh(new_product)
-
-    product_data = {
-        'id': new_product.id,
-        'name': new_product.name,
-        'description': new_product.description,
-        'price': new_product.price,
-        'stock': new_product.stock,
-        'created_at': new_product.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    }
-
-    session.close()
+    session.flush()
+
+    product_data = serialize_product(new_product)
+
     return product_data, 201
 
 
+def bulk_create_products(items):
+    """Add many products in one transaction, or none of them, reporting every rejected item."""
+    error, item_errors = validate_items(items, {'name': STRING, 'price': AMOUNT, 'stock': COUNT},
+                                        {'description': TEXT})
+    if error:
+        return {'error': error}, 400
+    if item_errors:
+        return {'error': invalid_items(item_errors), 'errors': item_errors}, 400
+
+    rows = [{
+        'name': item['name'],
+        'description': item.get('description', ''),
+        'price': item['price'],
+        'stock': item['stock']
+    } for item in items]
+
+    session = Session()
+    product_ids = insert_rows(session, Product, rows)
+
+    return {'ids': product_ids, 'count': len(product_ids)}, 201
+
+
 def update_product(product_id, data):
     """Update details of an existing product."""
-    session = SessionFactory()
+    session = Session()
     product = session.query(Product).filter(Product.id == product_id).one_or_none()
 
     if not product:
-        session.close()
         return {'error': 'Product not found'}, 404
 
     product.name = data.get('name', product.name)
@@ -67,32 +131,28 @@ def update_product(product_id, data):
     product.price = data.get('price', product.price)
     product.stock = data.get('stock', product.stock)
 
-    session.commit()
+    session.flush()
+    after_commit(lambda: product_cache.invalidate(product_id))
 
-    updated_product_data = {
-        'id': product.id,
-        'name': product.name,
-        'description': product.description,
-        'price': product.price,
-        'stock': product.stock,
-        'created_at': product.created_at.strftime('%Y-%m-%d %H:%M:%S')
-    }
+    updated_product_data = serialize_product(product)
 
-    session.close()
     return updated_product_data, 200
 
 
 def delete_product(product_id):
     """Delete a product by its ID."""
-    session = SessionFactory()
+    session = Session()
     product = session.query(Product).filter(Product.id == product_id).one_or_none()
 
     if not product:
-        session.close()
         return {'error': 'Product not found'}, 404
 
+    # Order lines keep pointing at the product they sold
+    if session.scalar(select(OrderDetails.id).where(OrderDetails.product_id == product_id).limit(1)) is not None:
+        return {'error': 'Product has been ordered and cannot be deleted'}, 409
+
     session.delete(product)
-    session.commit()
+    session.flush()
+    after_commit(lambda: product_cache.invalidate(product_id))
 
-    session.close()
     return {'message': 'Product deleted successfully'}, 200
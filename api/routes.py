@@ -0,0 +1,196 @@
+from web.metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from web.routing import Router
+from api.cache import caches
+from api.exports import export_orders, export_order_details
+from api.conditional import conditional_get, version_lookup
+from db.models import Order, OrderDetails
+from api.user_routes import (list_users, get_user, get_user_stats, create_user, bulk_create_users, update_user,
+                             delete_user)
+from api.product_routes import (list_products, search_products, get_product, get_product_stats, create_product,
+                                bulk_create_products, update_product, delete_product)
+from api.order_routes import list_orders, get_order, create_order, checkout, update_order, delete_order
+from api.order_details_routes import (list_order_details, get_order_detail, create_order_detail, bulk_create_order_details,
+                                      update_order_detail, delete_order_detail)
+
+# Every route takes the request plus its path parameters and returns (content, status),
+# or (content, status, headers) when it adds response headers. Content is encoded as JSON
+# unless it is already bytes, or an iterator of bytes chunks to be streamed
+router = Router()
+
+
+# Users
+
+@router.route('GET', '/users')
+def _list_users(request):
+    return list_users(request.query)
+
+
+@router.route('POST', '/users')
+def _create_user(request):
+    return create_user(request.json())
+
+
+@router.route('POST', '/users/bulk')
+def _bulk_create_users(request):
+    return bulk_create_users(request.json())
+
+
+@router.route('GET', '/users/{user_id:int}')
+def _get_user(request, user_id):
+    # Served from the user cache, so the cached copy is checked instead of looking up the version
+    return conditional_get(request, lambda: get_user(user_id))
+
+
+@router.route('GET', '/users/{user_id:int}/stats')
+def _get_user_stats(request, user_id):
+    return get_user_stats(user_id)
+
+
+@router.route('PUT', '/users/{user_id:int}')
+def _update_user(request, user_id):
+    return update_user(user_id, request.json())
+
+
+@router.route('DELETE', '/users/{user_id:int}')
+def _delete_user(request, user_id):
+    return delete_user(user_id)
+
+
+# Products
+
+@router.route('GET', '/products')
+def _list_products(request):
+    return list_products(request.query)
+
+
+@router.route('POST', '/products')
+def _create_product(request):
+    return create_product(request.json())
+
+
+@router.route('GET', '/products/search')
+def _search_products(request):
+    return search_products(request.query)
+
+
+@router.route('POST', '/products/bulk')
+def _bulk_create_products(request):
+    return bulk_create_products(request.json())
+
+
+@router.route('GET', '/products/{product_id:int}')
+def _get_product(request, product_id):
+    return conditional_get(request, lambda: get_product(product_id))
+
+
+@router.route('GET', '/products/{product_id:int}/stats')
+def _get_product_stats(request, product_id):
+    return get_product_stats(product_id)
+
+
+@router.route('PUT', '/products/{product_id:int}')
+def _update_product(request, product_id):
+    return update_product(product_id, request.json())
+
+
+@router.route('DELETE', '/products/{product_id:int}')
+def _delete_product(request, product_id):
+    return delete_product(product_id)
+
+
+# Orders
+
+@router.route('GET', '/orders')
+def _list_orders(request):
+    return list_orders(request.query)
+
+
+@router.route('POST', '/orders')
+def _create_order(request):
+    data = request.json()
+    return create_order(data['user_id'], data['total'])
+
+
+@router.route('POST', '/orders/checkout')
+def _checkout(request):
+    data = request.json()
+    return checkout(data['user_id'], data['items'])
+
+
+@router.route('GET', '/orders/{order_id:int}')
+def _get_order(request, order_id):
+    expand = [name for value in request.query.get('expand', []) for name in value.split(',') if name]
+    if expand:
+        return get_order(order_id, expand)
+    return conditional_get(request, lambda: get_order(order_id), version_lookup(Order, order_id))
+
+
+@router.route('PUT', '/orders/{order_id:int}')
+def _update_order(request, order_id):
+    return update_order(order_id, request.json().get('total'))
+
+
+@router.route('DELETE', '/orders/{order_id:int}')
+def _delete_order(request, order_id):
+    return delete_order(order_id)
+
+
+# Order details
+
+@router.route('GET', '/orderdetails')
+def _list_order_details(request):
+    return list_order_details(request.query)
+
+
+@router.route('POST', '/orderdetails')
+def _create_order_detail(request):
+    data = request.json()
+    return create_order_detail(data['order_id'], data['product_id'], data['quantity'])
+
+
+@router.route('POST', '/orderdetails/bulk')
+def _bulk_create_order_details(request):
+    return bulk_create_order_details(request.json())
+
+
+@router.route('GET', '/orderdetails/{order_detail_id:int}')
+def _get_order_detail(request, order_detail_id):
+    return conditional_get(request, lambda: get_order_detail(order_detail_id),
+                           version_lookup(OrderDetails, order_detail_id))
+
+
+@router.route('PUT', '/orderdetails/{order_detail_id:int}')
+def _update_order_detail(request, order_detail_id):
+    return update_order_detail(order_detail_id, request.json().get('quantity'))
+
+
+@router.route('DELETE', '/orderdetails/{order_detail_id:int}')
+def _delete_order_detail(request, order_detail_id):
+    return delete_order_detail(order_detail_id)
+
+
+# Exports
+
+@router.route('GET', '/exports/orders')
+def _export_orders(request):
+    return export_orders(request.query)
+
+
+@router.route('GET', '/exports/orderdetails')
+def _export_order_details(request):
+    return export_order_details(request.query)
+
+
+# Operations
+
+@router.route('GET', '/cache/stats')
+def _cache_stats(request):
+    return {name: cache.stats() for name, cache in caches.items()}, 200
+
+
+@router.route('GET', '/metrics')
+def _metrics(request):
+    return metrics.render(caches), 200, [('Content-Type', METRICS_CONTENT_TYPE)]
+
+
+router.compile()
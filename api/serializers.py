@@ -0,0 +1,64 @@
+from datetime import date, datetime
+from operator import attrgetter
+from sqlalchemy import select
+from db.models import User, Product, Order, OrderDetails
+
+# Serializer for each model, by model class
+serializers = {}
+
+
+class Serializer:
+    """Turns rows of one model into response dicts, using a field list fixed when it is registered.
+
+    Call it with an ORM object, or use select() and from_row() to read plain column tuples
+    through SQLAlchemy Core, which skips building ORM objects and tracking them in the
+    session's identity map. Both produce the same dict.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = tuple(fields)
+        self.columns = tuple(getattr(model, field) for field in self.fields)
+        get_values = attrgetter(*self.fields)
+        self._get_values = get_values if len(self.fields) > 1 else lambda obj: (get_values(obj),)
+
+        # Only date and time columns need converting; everything else is already JSON-ready
+        self._temporal_positions = tuple(
+            position for position, column in enumerate(self.columns)
+            if column.type.python_type in (datetime, date)
+        )
+
+    def __call__(self, obj):
+        return self.from_row(self._get_values(obj))
+
+    def from_row(self, row):
+        if not self._temporal_positions:
+            return dict(zip(self.fields, row))
+
+        values = list(row)
+        for position in self._temporal_positions:
+            value = values[position]
+            if value is not None:
+                values[position] = value.isoformat()
+        return dict(zip(self.fields, values))
+
+    def select(self):
+        """A Core SELECT of exactly the serialized columns."""
+        return select(*self.columns)
+
+    def fetch_by_id(self, session, row_id):
+        """Serialize one row by primary key without loading an ORM object, or return None."""
+        row = session.execute(self.select().where(self.model.id == row_id)).first()
+        return self.from_row(row) if row is not None else None
+
+
+def register(model, fields):
+    serializers[model] = Serializer(model, fields)
+    return serializers[model]
+
+
+# Passwords are never part of a response
+register(User, ('id', 'username', 'email', 'created_at', 'updated_at', 'version'))
+register(Product, ('id', 'name', 'description', 'price', 'stock', 'created_at', 'updated_at', 'version'))
+register(Order, ('id', 'user_id', 'total', 'created_at', 'updated_at', 'version'))
+register(OrderDetails, ('id', 'order_id', 'product_id', 'quantity', 'sub_total', 'updated_at', 'version'))
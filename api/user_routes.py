@@ -1,6 +1,17 @@
-import json
-from db.models import User
-from db.session import SessionFactory
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from db.aggregates import user_stats
+from db.models import Order, User
+from db.session import Session, after_commit, read_from_primary
+from api.bulk import STRING, ANY_STRING, validate_items, invalid_items, insert_rows, batches
+from api.cache import LRUCache
+from api.passwords import hash_password, hash_passwords
+from api.pagination import parse_page, fetch_page
+from api.serializers import serializers
+import settings
+
+user_cache = LRUCache('users', settings.CACHE_SIZE, settings.CACHE_TTL)
+serialize_user = serializers[User]
 
 
 # Utility to extract JSON data from a request
@@ -13,25 +24,48 @@ def extract_request_payload(request):
 
 def get_user(user_id):
     """Retrieve user details based on user_id."""
-    session = SessionFactory()
-    user = session.query(User).filter_by(id=user_id).first()
-    session.close()
+    user_data = user_cache.get_or_load(user_id, lambda: _load_user(user_id))
 
-    if not user:
+    if not user_data:
         return {
             'status': 'error',
             'message': f'User with ID {user_id} not found'
         }, 404
 
-    user_data = {
-        'id': user.id,
-        'username': user.username,
-        'email': user.email,
-        'created_at': user.created_at.isoformat()
-    }
     return user_data, 200
 
 
+def _load_user(user_id):
+    # A lagging replica could put a stale copy in the cache for the whole TTL
+    read_from_primary()
+    return serialize_user.fetch_by_id(Session(), user_id)
+
+
+def get_user_stats(user_id):
+    """Retrieve a user's order count and lifetime spend."""
+    stats = user_stats(Session(), user_id)
+
+    if not stats:
+        return {
+            'status': 'error',
+            'message': f'User with ID {user_id} not found'
+        }, 404
+
+    return stats, 200
+
+
+def list_users(query):
+    """List users a page at a time."""
+    page, error = parse_page(query)
+    if error:
+        return {
+            'status': 'error',
+            'message': error
+        }, 400
+
+    return fetch_page(Session(), serialize_user, page), 200
+
+
 def create_user(request):
     """Create a new user."""
     data = extract_request_payload(request)
@@ -41,66 +75,157 @@ def create_user(request):
             'status': 'error',
             'message': 'Missing required data'
         }, 400
+    if not isinstance(data['password'], str):
+        return {
+            'status': 'error',
+            'message': 'Password must be a string'
+        }, 400
 
-    user = User(username=data['username'], email=data['email'],
-                password=data['password'])  # TODO: Hash password before storage for security
-    session = SessionFactory()
+    # Hashed before the session is opened, so no transaction waits on it
+    user = User(username=data['username'], email=data['email'], password=hash_password(data['password']))
+    session = Session()
     session.add(user)
-    session.commit()
-    session.close()
+    try:
+        session.flush()
+    except IntegrityError:
+        return _not_unique()
+
+    return serialize_user(user), 201
+
+
+def bulk_create_users(items):
+    """Create many users in one transaction, or none of them, reporting every rejected item."""
+    error, item_errors = validate_items(items, {'username': STRING, 'email': STRING, 'password': ANY_STRING},
+                                        max_items=settings.BULK_MAX_USERS)
+    if error:
+        return {
+            'status': 'error',
+            'message': error
+        }, 400
+    # Checked before hashing, which costs far more than these lookups
+    malformed = {item_error['index'] for item_error in item_errors}
+    conflicts = _taken_usernames_and_emails(Session(), items, malformed)
+    if item_errors or conflicts:
+        item_errors = sorted(item_errors + conflicts, key=lambda item_error: item_error['index'])
+        return {
+            'status': 'error',
+            'message': invalid_items(item_errors),
+            'errors': item_errors
+        }, 400 if malformed else 409
+
+    passwords = hash_passwords(item['password'] for item in items)
+    rows = [{
+        'username': item['username'],
+        'email': item['email'],
+        'password': password
+    } for item, password in zip(items, passwords)]
+
+    session = Session()
+    try:
+        user_ids = insert_rows(session, User, rows)
+    except IntegrityError:
+        # Taken by a concurrent request since the check above
+        return _not_unique()
 
     return {
         'status': 'success',
-        'message': f'User {user.username} created successfully',
-        'user_id': user.id
+        'message': f'{len(user_ids)} users created successfully',
+        'user_ids': user_ids
     }, 201
 
 
+def _taken_usernames_and_emails(session, items, skipped=()):
+    """Return an error for every item whose username or email exists already or repeats an earlier item's.
+
+    Items at the indexes in skipped are malformed and left out.
+    """
+    items = [(index, item) for index, item in enumerate(items) if index not in skipped]
+    taken = {}
+    for field in ('username', 'email'):
+        column = getattr(User, field)
+        values = {item[field] for _, item in items}
+        taken[field] = set()
+        for batch in batches(values):
+            taken[field].update(session.scalars(select(column).where(column.in_(batch))))
+
+    item_errors = []
+    seen = {'username': set(), 'email': set()}
+    for index, item in items:
+        problems = []
+        for field in ('username', 'email'):
+            if item[field] in taken[field]:
+                problems.append(f'{field} {item[field]!r} is already taken')
+            elif item[field] in seen[field]:
+                problems.append(f'{field} {item[field]!r} appears earlier in the request')
+            seen[field].add(item[field])
+        if problems:
+            item_errors.append({'index': index, 'error': '; '.join(problems)})
+    return item_errors
+
+
+def _not_unique():
+    # The database's error would echo the statement's parameters, password hash included
+    return {
+        'status': 'error',
+        'message': 'A username or email is missing or already taken'
+    }, 409
+
+
 def update_user(user_id, request):
     """Update user details based on user_id."""
-    session = SessionFactory()
+    data = extract_request_payload(request)
+    if 'password' in data and not isinstance(data['password'], str):
+        return {
+            'status': 'error',
+            'message': 'Password must be a string'
+        }, 400
+
+    session = Session()
     user = session.query(User).filter_by(id=user_id).first()
 
     if not user:
-        session.close()
         return {
             'status': 'error',
             'message': f'User with ID {user_id} not found'
         }, 404
 
-    data = extract_request_payload(request)
-
     if 'username' in data:
         user.username = data['username']
     if 'email' in data:
         user.email = data['email']
     if 'password' in data:
-        user.password = data['password']  # TODO: Hash password before storage for security
+        user.password = hash_password(data['password'])
 
-    session.commit()
-    session.close()
+    try:
+        session.flush()
+    except IntegrityError:
+        return _not_unique()
+    after_commit(lambda: user_cache.invalidate(user_id))
 
-    return {
-        'status': 'success',
-        'message': f'User {user.username} updated successfully'
-    }, 200
+    return serialize_user(user), 200
 
 
 def delete_user(user_id):
     """Delete a user based on user_id."""
-    session = SessionFactory()
+    session = Session()
     user = session.query(User).filter_by(id=user_id).first()
 
     if not user:
-        session.close()
         return {
             'status': 'error',
             'message': f'User with ID {user_id} not found'
         }, 404
 
+    # Orders are kept for their history, so a user who placed any stays
+    if session.scalar(select(Order.id).where(Order.user_id == user_id).limit(1)) is not None:
+        return {
+            'status': 'error',
+            'message': f'User with ID {user_id} has orders and cannot be deleted'
+        }, 409
+
     session.delete(user)
-    session.commit()
-    session.close()
+    session.flush()
+    after_commit(lambda: user_cache.invalidate(user_id))
 
     return {
         'status': 'success',
@@ -0,0 +1,212 @@
+"""Drives the HTTP server with a mixed workload and reports throughput and latency percentiles.
+
+    python -m bench.load --mix mixed --concurrency 32 --duration 30 --save results.json
+    python -m bench.load --baseline results.json
+
+By default a fresh SQLite file is seeded with bench.seed and `server.py` is started on it in
+a subprocess, so the numbers cover the whole stack: sockets, HTTP parsing, routing and the
+database. Pass --url to measure a server that is already running and holds seeded data.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+from . import results as bench_results
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Workload:
+    """Builds random requests against ids known to exist in seeded data."""
+
+    def __init__(self, users, products, orders):
+        self.users = users
+        self.products = products
+        self.orders = orders
+
+    def get_product(self, rng):
+        return 'GET', f'/products/{rng.randint(1, self.products)}', None
+
+    def list_products(self, rng):
+        return 'GET', '/products?limit=50&order_by=created_at', None
+
+    def get_user(self, rng):
+        return 'GET', f'/users/{rng.randint(1, self.users)}', None
+
+    def get_order(self, rng):
+        return 'GET', f'/orders/{rng.randint(1, self.orders)}?expand=order_details', None
+
+    def order_history(self, rng):
+        return 'GET', f'/orders?user_id={rng.randint(1, self.users)}&order_by=created_at', None
+
+    def checkout(self, rng):
+        items = [{'product_id': rng.randint(1, self.products), 'quantity': rng.randint(1, 3)}
+                 for _ in range(rng.randint(1, 4))]
+        return 'POST', '/orders/checkout', {'user_id': rng.randint(1, self.users), 'items': items}
+
+    def create_order_detail(self, rng):
+        return 'POST', '/orderdetails', {'order_id': rng.randint(1, self.orders),
+                                         'product_id': rng.randint(1, self.products), 'quantity': 1}
+
+
+# Relative weight of each Workload scenario
+MIXES = {
+    'read': {'get_product': 40, 'get_user': 20, 'get_order': 20, 'list_products': 10, 'order_history': 10},
+    'mixed': {'get_product': 35, 'get_user': 15, 'get_order': 15, 'list_products': 10, 'order_history': 5,
+              'checkout': 15, 'create_order_detail': 5},
+    'write': {'checkout': 70, 'create_order_detail': 30},
+}
+
+
+def run_load(host, port, workload, mix, concurrency, duration, warmup=0.0, seed=42):
+    """Send requests from concurrency keep-alive connections for duration seconds.
+
+    Returns {scenario: summary} plus an 'all' entry; requests during the warmup are not counted.
+    """
+    scenarios, weights = zip(*MIXES[mix].items())
+    samples = {scenario: [] for scenario in scenarios}
+    errors = {scenario: 0 for scenario in scenarios}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    def client(number):
+        rng = random.Random(seed + number)
+        conn = HTTPConnection(host, port, timeout=30)
+        latencies = {scenario: [] for scenario in scenarios}
+        failures = {scenario: 0 for scenario in scenarios}
+        try:
+            while True:
+                scenario = rng.choices(scenarios, weights)[0]
+                method, path, body = getattr(workload, scenario)(rng)
+                payload = json.dumps(body) if body is not None else None
+                began = time.perf_counter()
+                if began >= deadline:
+                    break
+                try:
+                    conn.request(method, path, body=payload, headers={'Accept-Encoding': 'gzip'})
+                    response = conn.getresponse()
+                    response.read()
+                    failed = response.status >= 500
+                except (OSError, ConnectionError):
+                    conn.close()
+                    failed = True
+                ended = time.perf_counter()
+                if began >= measure_from:
+                    latencies[scenario].append(ended - began)
+                    failures[scenario] += failed
+        finally:
+            conn.close()
+            with lock:
+                for scenario in scenarios:
+                    samples[scenario].extend(latencies[scenario])
+                    errors[scenario] += failures[scenario]
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    summaries = {scenario: bench_results.summarize(samples[scenario], duration, errors[scenario])
+                 for scenario in scenarios}
+    summaries['all'] = bench_results.summarize([latency for scenario in scenarios for latency in samples[scenario]],
+                                               duration, sum(errors.values()))
+    return summaries
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url, engine, workers, port):
+    """Start server.py in a subprocess on the prod profile and wait until it accepts connections."""
+    env = dict(os.environ, DATABASE_PROFILE='prod', DATABASE_URL=database_url)
+    process = subprocess.Popen(
+        [sys.executable, 'server.py', '--engine', engine, '--workers', str(workers), '--port', str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError(f'server.py exited with status {process.returncode}')
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('server.py did not start listening within 10 seconds')
+
+
+def seed_database(database_url, users, products, orders, details, seed):
+    path = urlparse(database_url).path.lstrip('/')
+    for suffix in ('', '-wal', '-shm'):
+        if path and os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    subprocess.run(
+        [sys.executable, '-m', 'bench.seed', '--profile', 'prod', '--database-url', database_url,
+         '--users', str(users), '--products', str(products), '--orders', str(orders),
+         '--details', str(details), '--seed', str(seed)],
+        cwd=ROOT, check=True,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the API server.')
+    parser.add_argument('--url', help='a running server to test, instead of starting one')
+    parser.add_argument('--database-url', default='sqlite:///bench.db',
+                        help='database seeded and served when no --url is given')
+    parser.add_argument('--no-seed', action='store_true', help='reuse the data already in --database-url')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--details', type=int, default=3)
+    parser.add_argument('--mix', choices=MIXES, default='mixed')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds run before measuring')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write the results as JSON, e.g. to keep as a baseline')
+    parser.add_argument('--baseline', help='compare against results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+
+    process = None
+    if args.url:
+        target = urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        if not args.no_seed:
+            seed_database(args.database_url, args.users, args.products, args.orders, args.details, args.seed)
+        host, port = 'localhost', free_port()
+        process = start_server(args.database_url, args.engine, args.workers, port)
+
+    try:
+        workload = Workload(args.users, args.products, args.orders)
+        summaries = run_load(host, port, workload, args.mix, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.save:
+        bench_results.save(summaries, args.save)
+    baseline = bench_results.load(args.baseline) if args.baseline else None
+    return 0 if bench_results.report(summaries, baseline, args.tolerance) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Times individual route functions and helpers in-process, without HTTP in the way.
+
+    python -m bench.micro --save micro.json
+    python -m bench.micro --baseline micro.json -k product
+
+Every call runs in its own unit of work against an in-memory database seeded by bench.seed,
+the same way the dispatcher runs a request. Timings are per call, in milliseconds.
+"""
+import argparse
+import random
+import sys
+import time
+from api import order_details_routes, order_routes, product_routes, user_routes
+from api.cache import caches
+from api.pagination import parse_page
+from db import session as db_session
+from web.app import encode_json
+from . import results as bench_results
+from .seed import seed
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+# Each benchmark takes (rng, sizes) and returns a callable that performs one operation
+
+@benchmark('get_product cached')
+def _get_product_cached(rng, sizes):
+    for product_id in range(1, 51):
+        product_routes.get_product(product_id)
+    return lambda: product_routes.get_product(rng.randint(1, 50))
+
+
+@benchmark('get_product uncached')
+def _get_product_uncached(rng, sizes):
+    def call():
+        product_routes.product_cache.clear()
+        product_routes.get_product(rng.randint(1, sizes['products']))
+    return call
+
+
+@benchmark('get_user cached')
+def _get_user_cached(rng, sizes):
+    for user_id in range(1, 51):
+        user_routes.get_user(user_id)
+    return lambda: user_routes.get_user(rng.randint(1, 50))
+
+
+@benchmark('get_order expanded')
+def _get_order_expanded(rng, sizes):
+    return lambda: order_routes.get_order(rng.randint(1, sizes['orders']), ['order_details.product'])
+
+
+@benchmark('list_products page')
+def _list_products(rng, sizes):
+    query = {'limit': ['50'], 'order_by': ['created_at']}
+    return lambda: product_routes.list_products(query)
+
+
+@benchmark('create_order_detail')
+def _create_order_detail(rng, sizes):
+    return lambda: order_details_routes.create_order_detail(
+        rng.randint(1, sizes['orders']), rng.randint(1, sizes['products']), 1)
+
+
+@benchmark('checkout')
+def _checkout(rng, sizes):
+    return lambda: order_routes.checkout(rng.randint(1, sizes['users']), [
+        {'product_id': rng.randint(1, sizes['products']), 'quantity': 1} for _ in range(3)
+    ])
+
+
+@benchmark('parse_page')
+def _parse_page(rng, sizes):
+    query = {'limit': ['20'], 'order_by': ['created_at'], 'user_id': ['7']}
+    return lambda: parse_page(query, {'user_id': int})
+
+
+@benchmark('encode_json page')
+def _encode_json(rng, sizes):
+    status = product_routes.list_products({'limit': ['50']})
+    return lambda: encode_json(status[0])
+
+
+def time_calls(operation, iterations, warmup):
+    """Run operation in a unit of work per call and return the duration of each measured call."""
+    for _ in range(warmup):
+        with db_session.request_scope():
+            operation()
+
+    durations = []
+    for _ in range(iterations):
+        began = time.perf_counter()
+        with db_session.request_scope():
+            operation()
+        durations.append(time.perf_counter() - began)
+    return durations
+
+
+def run_benchmarks(names, iterations=1000, warmup=100, sizes=None, seed_value=42):
+    """Seed a fresh in-memory database and return {benchmark name: summary}."""
+    sizes = sizes or {'users': 1000, 'products': 500, 'orders': 5000, 'details': 3}
+    db_session.configure('test')
+    db_session.init_db()
+    for cache in caches.values():
+        cache.clear()
+    seed(sizes['users'], sizes['products'], sizes['orders'], sizes['details'], seed_value)
+
+    summaries = {}
+    for name in names:
+        with db_session.request_scope():
+            operation = BENCHMARKS[name](random.Random(seed_value), sizes)
+        durations = time_calls(operation, iterations, warmup)
+        summaries[name] = bench_results.summarize(durations, sum(durations))
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmark route functions and helpers.')
+    parser.add_argument('-k', dest='pattern', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write the results as JSON, e.g. to keep as a baseline')
+    parser.add_argument('--baseline', help='compare against results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS if args.pattern in name]
+    summaries = run_benchmarks(names, args.iterations, args.warmup, seed_value=args.seed)
+
+    if args.save:
+        bench_results.save(summaries, args.save)
+    baseline = bench_results.load(args.baseline) if args.baseline else None
+    return 0 if bench_results.report(summaries, baseline, args.tolerance) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Summary statistics for benchmark runs and comparison against a stored baseline.
+
+Results are {case name: {metric: value}}. Latencies are in milliseconds and lower is better;
+throughput is in operations per second and higher is better.
+"""
+import json
+import math
+
+# Metrics where a larger number is an improvement
+HIGHER_IS_BETTER = {'throughput'}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, elapsed=None, errors=0):
+    """Latency percentiles in milliseconds, plus throughput when the wall-clock time is known."""
+    latencies = sorted(latencies)
+    summary = {
+        'count': len(latencies),
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+    }
+    if elapsed:
+        summary['throughput'] = len(latencies) / elapsed
+    if errors:
+        summary['errors'] = errors
+    return summary
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.10):
+    """Return (case, metric, baseline, current, relative change, regressed) for every shared metric.
+
+    The relative change is signed so that positive always means better. A metric regresses when
+    it got worse by more than tolerance, e.g. 0.10 for 10%.
+    """
+    rows = []
+    for case, metrics in results.items():
+        for metric, current in metrics.items():
+            before = baseline.get(case, {}).get(metric)
+            if before is None or metric in ('count', 'errors') or not before:
+                continue
+            change = (current - before) / before
+            if metric not in HIGHER_IS_BETTER:
+                change = -change
+            rows.append((case, metric, before, current, change, change < -tolerance))
+    return rows
+
+
+def report(results, baseline=None, tolerance=0.10, out=print):
+    """Print results, and the change against baseline when given. Returns True if nothing regressed."""
+    if baseline is None:
+        for case, metrics in results.items():
+            out(f"{case:32} " + '  '.join(f'{metric} {_format(value)}' for metric, value in metrics.items()))
+        return True
+
+    rows = compare(results, baseline, tolerance)
+    for case, metric, before, current, change, regressed in rows:
+        flag = 'REGRESSED' if regressed else ''
+        out(f'{case:32} {metric:10} {before:12,.2f} -> {current:12,.2f}  {change:+7.1%}  {flag}')
+    return not any(row[-1] for row in rows)
+
+
+def _format(value):
+    return f'{value:,.2f}' if isinstance(value, float) else f'{value:,}'
@@ -0,0 +1,93 @@
+"""Fills the database with a reproducible data set for benchmarks.
+
+    python -m bench.seed --users 10000 --products 2000 --orders 50000 --details 3 --seed 42
+
+The same arguments always produce the same rows, so runs on different commits measure the
+same data. The target is DATABASE_URL under the chosen profile, see db/session.py.
+"""
+import argparse
+from datetime import datetime, timedelta
+import random
+import sys
+from api.bulk import insert_rows
+from api.passwords import hash_password
+from db import aggregates, session as db_session
+from db.models import User, Product, Order, OrderDetails
+
+# All generated created_at values fall in the year before this
+EPOCH = datetime(2024, 1, 1)
+
+
+def seed(users=1000, products=500, orders=5000, details=3, seed=42):
+    """Insert generated rows into the current database and return the row count per table."""
+    rng = random.Random(seed)
+
+    def created_at():
+        return EPOCH - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+    # Hashing thousands of passwords would dominate seeding; they share one hash instead
+    password = hash_password('password')
+
+    counts = {}
+    with db_session.request_scope():
+        session = db_session.Session()
+
+        user_ids = insert_rows(session, User, [
+            {'username': f'user{n}', 'email': f'user{n}@example.com', 'password': password,
+             'created_at': created_at()}
+            for n in range(users)
+        ])
+        prices = [round(rng.uniform(1, 100), 2) for _ in range(products)]
+        product_ids = insert_rows(session, Product, [
+            {'name': f'Product {n}', 'description': f'Description of product {n}', 'price': price,
+             'stock': rng.randrange(10000, 100000), 'created_at': created_at()}
+            for n, price in enumerate(prices)
+        ])
+        price_of = dict(zip(product_ids, prices))
+
+        order_rows, detail_lines = [], []
+        for _ in range(orders if user_ids and product_ids else 0):
+            lines = [(product_id, rng.randint(1, 5))
+                     for product_id in rng.sample(product_ids, min(details, len(product_ids)))]
+            order_rows.append({'user_id': rng.choice(user_ids), 'created_at': created_at(),
+                               'total': round(sum(price_of[product_id] * quantity for product_id, quantity in lines), 2)})
+            detail_lines.append(lines)
+        order_ids = insert_rows(session, Order, order_rows)
+
+        insert_rows(session, OrderDetails, [
+            {'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+             'sub_total': round(price_of[product_id] * quantity, 2)}
+            for order_id, lines in zip(order_ids, detail_lines)
+            for product_id, quantity in lines
+        ])
+        # The rows above bypass the routes that keep the aggregates up to date
+        aggregates.rebuild(session.connection())
+
+        counts = {'users': len(user_ids), 'products': len(product_ids), 'orders': len(order_ids),
+                  'order_details': sum(len(lines) for lines in detail_lines)}
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fill the database with generated benchmark data.')
+    parser.add_argument('--profile', default=db_session.DATABASE_PROFILE, choices=db_session.PROFILES)
+    parser.add_argument('--database-url', help='defaults to DATABASE_URL')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--details', type=int, default=3, help='order details per order')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    db_session.configure(args.profile, args.database_url)
+    # Keep the dev profile's statement log out of the way of tens of thousands of inserts
+    db_session.engine.echo = False
+    db_session.init_db()
+
+    counts = seed(args.users, args.products, args.orders, args.details, args.seed)
+    print(', '.join(f'{count} {table}' for table, count in counts.items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Per-user order totals and per-product sales, kept up to date instead of summed on every read.
+
+user_stats holds each user's order count and lifetime spend, product_stats each product's units
+sold and revenue. Every route that writes orders or order details adds its change to them in the
+same transaction, so they commit and roll back together with the rows they sum, and reading them
+is a primary key lookup however many orders there are.
+
+Run `python -m db.aggregates verify` to compare them with totals recomputed from orders and
+order_details, and `python -m db.aggregates rebuild` to replace them with those totals.
+"""
+import math
+import sys
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.sqlite import insert as upsert
+from .models import User, Product, Order, OrderDetails, UserStats, ProductStats
+
+AGGREGATE_TABLES = (UserStats.__tablename__, ProductStats.__tablename__)
+
+
+def add_to_user_stats(session, user_id, orders, spent):
+    """Add orders to a user's order count and spent to their total; negative values take them away."""
+    _add(session, UserStats, UserStats.user_id, user_id, order_count=orders, total_spent=spent)
+
+
+def add_to_product_stats(session, product_id, units, revenue):
+    """Add units and revenue to a product's sales; negative values take them away."""
+    _add(session, ProductStats, ProductStats.product_id, product_id, units_sold=units, revenue=revenue)
+
+
+def _add(session, model, key_column, key, **deltas):
+    # INSERT ... ON CONFLICT DO UPDATE creates the row on first use, and the increment is done by
+    # the database, so concurrent transactions can't lose each other's updates
+    statement = (upsert(model).values({key_column.name: key, **deltas})
+                 .on_conflict_do_update(index_elements=[key_column],
+                                        set_={name: getattr(model, name) + delta for name, delta in deltas.items()}))
+    session.execute(statement)
+
+
+def user_stats(session, user_id):
+    """Return a user's order count and lifetime spend, or None if there is no such user."""
+    row = session.execute(
+        select(User.id, UserStats.order_count, UserStats.total_spent)
+        .outerjoin(UserStats, UserStats.user_id == User.id)
+        .where(User.id == user_id)
+    ).first()
+    if row is None:
+        return None
+    return {'user_id': row.id, 'order_count': row.order_count or 0, 'total_spent': row.total_spent or 0.0}
+
+
+def product_stats(session, product_id):
+    """Return a product's units sold and revenue, or None if there is no such product."""
+    row = session.execute(
+        select(Product.id, ProductStats.units_sold, ProductStats.revenue)
+        .outerjoin(ProductStats, ProductStats.product_id == Product.id)
+        .where(Product.id == product_id)
+    ).first()
+    if row is None:
+        return None
+    return {'product_id': row.id, 'units_sold': row.units_sold or 0, 'revenue': row.revenue or 0.0}
+
+
+# For each aggregate table: its key and value columns, and the query recomputing them from the base table
+_SOURCES = {
+    UserStats: (
+        ('user_id', 'order_count', 'total_spent'),
+        select(Order.user_id, func.count(Order.id), func.sum(Order.total)).group_by(Order.user_id),
+    ),
+    ProductStats: (
+        ('product_id', 'units_sold', 'revenue'),
+        select(OrderDetails.product_id, func.sum(OrderDetails.quantity), func.sum(OrderDetails.sub_total))
+        .group_by(OrderDetails.product_id),
+    ),
+}
+
+
+def rebuild(connection):
+    """Replace every aggregate with totals recomputed from orders and order_details."""
+    for model, (columns, source) in _SOURCES.items():
+        connection.execute(delete(model))
+        connection.execute(insert(model).from_select(columns, source))
+
+
+def verify(connection):
+    """Return (table, key, stored, expected) for every aggregate that doesn't match the base tables.
+
+    A missing row counts as zeros, and sums of money compare with a small tolerance, as adding
+    amounts one at a time can round differently from summing them in one go.
+    """
+    drift = []
+    for model, (columns, source) in _SOURCES.items():
+        expected = {row[0]: tuple(row[1:]) for row in connection.execute(source)}
+        stored = {row[0]: tuple(row[1:]) for row in connection.execute(select(*(getattr(model, name) for name in columns)))}
+        zeros = (0, 0.0)
+        for key in sorted(expected.keys() | stored.keys()):
+            have, want = stored.get(key, zeros), expected.get(key, zeros)
+            if not all(math.isclose(a, b, abs_tol=1e-6) for a, b in zip(have, want)):
+                drift.append((model.__tablename__, key, have, want))
+    return drift
+
+
+def main(argv=None):
+    import argparse
+    from .session import engine, init_db
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=('verify', 'rebuild'))
+    args = parser.parse_args(argv)
+
+    # Keep the dev profile's statement log out of the report
+    engine.echo = False
+    init_db()
+
+    if args.command == 'rebuild':
+        with engine.begin() as connection:
+            rebuild(connection)
+        print('Aggregates rebuilt')
+        return 0
+
+    with engine.connect() as connection:
+        drift = verify(connection)
+    for table, key, stored, expected in drift:
+        print(f'{table} {key}: stored {stored}, expected {expected}')
+    print(f'{len(drift)} aggregates out of date' if drift else 'Aggregates match')
+    return 1 if drift else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
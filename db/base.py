@@ -1,13 +1,5 @@
 # merch_store_api/db/base.py
 
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-DATABASE_URL = "sqlite:///./test.db"  # using SQLite for simplicity
-
-engine = create_engine(DATABASE_URL)
-
-SessionLocal = sessionmaker(bind=engine)
-
-Base = declarative_base(bind=engine, metadata=MetaData)
+# The models and the one engine live in db.models and db.session; these names are kept for older imports
+from .models import Base
+from .session import engine, SessionFactory as SessionLocal
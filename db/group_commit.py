@@ -0,0 +1,148 @@
+"""Group commit: concurrent write requests share one transaction and one commit.
+
+With SQLite every commit waits for the disk to flush, so at high write rates commits, not
+CPU, set the ceiling. When GROUP_COMMIT is on, route functions wrapped in batched() don't
+run on the request thread. They are queued for a single writer thread, which collects
+writes for up to GROUP_COMMIT_WINDOW seconds or GROUP_COMMIT_BATCH_SIZE writes. It runs
+each write in its own SAVEPOINT and then commits the whole batch once.
+
+Each caller gets its own result. A write that raises or returns an error status is rolled
+back to its savepoint alone, and its after_commit callbacks are dropped. The other writes
+in the batch are unaffected. If the final commit fails, every write in the batch gets that
+error. A caller only gets its response once the batch has committed, so a success is always
+durable. A caller that gives up after GROUP_COMMIT_TIMEOUT cancels its write, so a failure is
+never committed later. If its batch has already started, it waits for that batch instead.
+"""
+from concurrent.futures import Future, TimeoutError
+from functools import wraps
+import os
+import queue
+import threading
+import time
+import settings
+from .session import Session, end_request
+
+
+class GroupCommitter:
+    """Single writer thread committing queued writes in batches."""
+
+    def __init__(self, window=None, batch_size=None):
+        self.window = settings.GROUP_COMMIT_WINDOW if window is None else window
+        self.batch_size = batch_size or settings.GROUP_COMMIT_BATCH_SIZE
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args):
+        """Queue function(*args) to run in the next batch and return a Future for its result."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((future, function, args))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        """Run and commit one batch, resolving every future in it whatever goes wrong."""
+        # Writes whose callers gave up waiting were cancelled and must not run at all
+        batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            results = self._run_batch(batch)
+        except Exception as e:
+            # Opening the transaction or a savepoint failed: nothing in the batch is committed
+            try:
+                end_request(commit=False)
+            except Exception:
+                pass
+            results = [(future, None, e) for future, _, _ in batch]
+
+        self.batches += 1
+        self.writes += len(batch)
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def _run_batch(self, batch):
+        session = Session()
+        _begin(session)
+        callbacks = session.info.setdefault('after_commit', [])
+        results = []
+        for future, function, args in batch:
+            kept = len(callbacks)
+            savepoint = session.begin_nested()
+            try:
+                result = function(*args)
+            except Exception as e:
+                savepoint.rollback()
+                del callbacks[kept:]
+                results.append((future, None, e))
+                continue
+            if result[1] >= 400:
+                savepoint.rollback()
+                del callbacks[kept:]
+            else:
+                savepoint.commit()
+            results.append((future, result, None))
+
+        try:
+            end_request(commit=True)
+        except Exception as e:
+            results = [(future, None, error or e) for future, _, error in results]
+        return results
+
+
+def _begin(session):
+    # pysqlite only emits BEGIN before DML, so the first SAVEPOINT would open the transaction
+    # itself and releasing it would commit that write on its own
+    connection = session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN')
+
+
+group_committer = GroupCommitter()
+
+
+def batched(function):
+    """Decorate a route function that only writes, so it joins a group commit when GROUP_COMMIT is on."""
+    @wraps(function)
+    def run(*args):
+        if not settings.GROUP_COMMIT:
+            return function(*args)
+        # A writer that never answers turns into a 500 rather than a request stuck forever
+        future = group_committer.submit(function, *args)
+        try:
+            return future.result(timeout=settings.GROUP_COMMIT_TIMEOUT)
+        except TimeoutError:
+            if future.cancel():
+                raise
+            # Already part of a batch in progress, which may still commit it; report what it does
+            return future.result()
+    return run
+
+
+def _forget_writer():
+    # The writer thread doesn't survive a fork; a forked worker starts its own on first use
+    global group_committer
+    group_committer = GroupCommitter()
+
+
+os.register_at_fork(after_in_child=_forget_writer)
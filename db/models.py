@@ -1,23 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.orm import relationship, declarative_base, declared_attr
 from datetime import datetime
 
 Base = declarative_base()
 
 
-class User(Base):
+class Versioned:
+    """Row version and last modification time, the validators behind ETag and Last-Modified.
+
+    The ORM bumps version on every UPDATE and checks it in the WHERE clause, so a concurrent
+    write to the same row fails with StaleDataError instead of being silently overwritten.
+    Core UPDATEs must bump it themselves.
+    """
+
+    version = Column(Integer, nullable=False, server_default='1')
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {'version_id_col': cls.version}
+
+
+class User(Versioned, Base):
     __tablename__ = 'users'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
-    password = Column(String, nullable=False)  # This would typically be hashed in a real-world scenario
-    created_at = Column(DateTime, default=datetime.utcnow)
+    password = Column(String, nullable=False)  # scrypt hash, see api/passwords.py
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     orders = relationship('Order', back_populates='user')
 
 
-class Product(Base):
+class Product(Versioned, Base):
     __tablename__ = 'products'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -25,31 +41,61 @@ class Product(Base):
     description = Column(String)
     price = Column(Float, nullable=False)
     stock = Column(Integer, default=0, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     order_details = relationship('OrderDetails', back_populates='product')
 
 
-class Order(Base):
+class Order(Versioned, Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Order history for a user, newest or oldest first; also serves lookups by user_id alone
+        Index('ix_orders_user_id_created_at', 'user_id', 'created_at'),
+        # A user's orders in the default id order, without sorting them
+        Index('ix_orders_user_id_id', 'user_id', 'id'),
+        # Incremental exports read rows changed since a watermark, in (updated_at, id) order
+        Index('ix_orders_updated_at', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     total = Column(Float, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship('User', back_populates='orders')
-    order_details = relationship('OrderDetails', back_populates='order')
+    # An order's lines go with it; order_id can't be nulled
+    order_details = relationship('OrderDetails', back_populates='order', cascade='all, delete-orphan')
 
 
-class OrderDetails(Base):
+class OrderDetails(Versioned, Base):
     __tablename__ = 'order_details'
+    __table_args__ = (
+        Index('ix_order_details_updated_at', 'updated_at'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
-    product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
+    product_id = Column(Integer, ForeignKey('products.id'), nullable=False, index=True)
     quantity = Column(Integer, nullable=False)
     sub_total = Column(Float, nullable=False)
 
     order = relationship('Order', back_populates='order_details')
     product = relationship('Product', back_populates='order_details')
+
+
+# Running totals kept by db/aggregates.py in the same transaction as the orders and order details they sum
+
+class UserStats(Base):
+    __tablename__ = 'user_stats'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    order_count = Column(Integer, default=0, nullable=False)
+    total_spent = Column(Float, default=0, nullable=False)
+
+
+class ProductStats(Base):
+    __tablename__ = 'product_stats'
+
+    product_id = Column(Integer, ForeignKey('products.id'), primary_key=True)
+    units_sold = Column(Integer, default=0, nullable=False)
+    revenue = Column(Float, default=0, nullable=False)
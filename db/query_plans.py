@@ -0,0 +1,101 @@
+"""Checks that the queries on the request path are answered from an index.
+
+Run `python -m db.query_plans` to print the plan of every hot query; it exits non-zero when one
+of them falls back to a full table scan or a temporary sort. The server runs the same check at
+startup unless CHECK_QUERY_PLANS is turned off.
+"""
+from datetime import datetime
+import sys
+from sqlalchemy import and_, or_, select, text
+from .models import User, Product, Order, OrderDetails, UserStats, ProductStats
+
+_SOME_TIME = datetime(2024, 1, 1)
+
+
+def _after_created_at(model):
+    return or_(model.created_at > _SOME_TIME, and_(model.created_at == _SOME_TIME, model.id > 1))
+
+
+# Queries the routes run on every request, with representative parameters
+HOT_QUERIES = {
+    'user by id': select(User).where(User.id == 1),
+    'product by id': select(Product).where(Product.id == 1),
+    'order by id': select(Order).where(Order.id == 1),
+    'order detail by id': select(OrderDetails).where(OrderDetails.id == 1),
+    'stats of a user': select(UserStats).where(UserStats.user_id == 1),
+    'stats of a product': select(ProductStats).where(ProductStats.product_id == 1),
+    'users page by created_at': select(User).where(_after_created_at(User))
+    .order_by(User.created_at, User.id).limit(51),
+    'products page by created_at': select(Product).where(_after_created_at(Product))
+    .order_by(Product.created_at, Product.id).limit(51),
+    'orders page by created_at': select(Order).where(_after_created_at(Order))
+    .order_by(Order.created_at, Order.id).limit(51),
+    'orders of a user': select(Order).where(Order.user_id == 1, Order.id > 1)
+    .order_by(Order.id).limit(51),
+    'order history of a user': select(Order).where(Order.user_id == 1, _after_created_at(Order))
+    .order_by(Order.created_at, Order.id).limit(51),
+    'order details of an order': select(OrderDetails).where(OrderDetails.order_id == 1),
+    'order details of a product': select(OrderDetails).where(OrderDetails.product_id == 1),
+    'orders export since a watermark': select(Order).where(Order.updated_at > _SOME_TIME)
+    .order_by(Order.updated_at, Order.id),
+    'order details export since a watermark': select(OrderDetails).where(OrderDetails.updated_at > _SOME_TIME)
+    .order_by(OrderDetails.updated_at, OrderDetails.id),
+    'order details page of an order': select(OrderDetails).where(OrderDetails.order_id == 1, OrderDetails.id > 1)
+    .order_by(OrderDetails.id).limit(51),
+}
+
+
+class QueryPlanError(Exception):
+    """A hot query would scan a whole table or sort its rows in a temporary b-tree."""
+
+
+def explain(connection, statement):
+    """Return the detail lines of SQLite's EXPLAIN QUERY PLAN for a statement."""
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    return [row[-1] for row in connection.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+
+
+def is_slow(detail):
+    if 'USE TEMP B-TREE' in detail:
+        return True
+    # "SCAN orders USING INDEX ..." walks an index in order and stops at the LIMIT; a bare SCAN reads every row
+    return detail.startswith('SCAN ') and ' USING ' not in detail
+
+
+def check_query_plans(engine, queries=None):
+    """Return {query name: plan} for every hot query whose plan contains a scan or a temporary sort."""
+    slow = {}
+    with engine.connect() as connection:
+        for name, statement in (queries or HOT_QUERIES).items():
+            plan = explain(connection, statement)
+            if any(is_slow(detail) for detail in plan):
+                slow[name] = plan
+    return slow
+
+
+def verify_query_plans(engine, queries=None):
+    """Raise QueryPlanError naming every hot query that isn't served from an index."""
+    slow = check_query_plans(engine, queries)
+    if slow:
+        lines = [f"  {name}: {'; '.join(plan)}" for name, plan in slow.items()]
+        raise QueryPlanError('Hot queries fall back to a scan, are the indexes missing?\n' + '\n'.join(lines))
+
+
+def main():
+    from .session import engine, init_db
+
+    # Keep the dev profile's statement log out of the report
+    engine.echo = False
+    init_db()
+
+    slow = check_query_plans(engine)
+    with engine.connect() as connection:
+        for name, statement in HOT_QUERIES.items():
+            status = 'SLOW' if name in slow else 'ok'
+            print(f"{status:4}  {name}: {'; '.join(explain(connection, statement))}")
+
+    return 1 if slow else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""Full-text index over product names and descriptions, backed by an SQLite FTS5 table.
+
+products_fts is an external-content table: it stores only the index and reads the text from
+products. Triggers update it in the same transaction as every INSERT, DELETE and UPDATE of
+name or description, whether the write comes from the ORM, a bulk insert or raw SQL.
+"""
+import re
+from sqlalchemy import column, literal_column, table, text
+
+products_fts = table('products_fts', column('rowid'), column('rank'))
+
+# Name matches weigh ten times as much as description matches in the bm25 ranking
+RANK = 'bm25(10.0, 1.0)'
+
+_DDL = (
+    # remove_diacritics lets "cafe" find "Café"; the prefix indexes serve short "shi*" queries
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "name, description, content='products', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, name, description) "
+    "VALUES ('delete', old.id, old.name, old.description); "
+    "INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description); END",
+)
+
+
+def create_search_index(connection):
+    """Create the index and its triggers if missing, indexing the products already in the table."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.scalar(text("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'"))
+    for statement in _DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text(f"INSERT INTO products_fts(products_fts, rank) VALUES ('rank', '{RANK}')"))
+        connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+
+def match(search_text):
+    """A MATCH condition finding rows with every word of search_text, the last one as a prefix.
+
+    Returns None when search_text has no words. Each word is quoted, so FTS5 query syntax
+    typed by a user (quotes, NEAR, column filters, a leading minus) is searched for literally
+    rather than raising a syntax error.
+    """
+    words = re.findall(r'\w+', search_text)
+    if not words:
+        return None
+    expression = ' '.join(f'"{word}"' for word in words) + '*'
+    return literal_column('products_fts').op('MATCH')(expression)
@@ -1,14 +1,222 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from contextlib import contextmanager
+import itertools
+import os
+import threading
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.orm import Session as OrmSession, scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Configuration
-DATABASE_URL = "sqlite:///./merch_store.db"  # Using SQLite for simplicity
+DATABASE_URL = os.environ.get('DATABASE_URL', "sqlite:///./merch_store.db")  # Using SQLite for simplicity
+# Comma-separated URLs of read replicas of DATABASE_URL; empty sends every query to the primary
+DATABASE_REPLICA_URLS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+# One of PROFILES
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'dev')
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
-SessionFactory = sessionmaker(bind=engine, expire_on_commit=False)
+# Engine settings by profile. 'pragmas' are applied to every new SQLite connection, 'url' overrides DATABASE_URL.
+PROFILES = {
+    # Logs every statement; fine for poking at the API locally, far too slow for real traffic
+    'dev': {
+        'echo': True,
+    },
+    # A private in-memory database shared by every session in the process
+    'test': {
+        'url': 'sqlite://',
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False},
+    },
+    'prod': {
+        'pool_size': int(os.environ.get('DATABASE_POOL_SIZE', '20')),
+        'max_overflow': int(os.environ.get('DATABASE_MAX_OVERFLOW', '10')),
+        'pool_timeout': 30,
+        'pool_pre_ping': True,
+        'pragmas': {
+            # Readers keep reading from the last commit while a writer appends to the log
+            'journal_mode': 'WAL',
+            # In WAL mode NORMAL only syncs at checkpoints; a power loss can drop the last
+            # commits but never corrupts the database
+            'synchronous': 'NORMAL',
+            # Negative sizes are in KiB: 64 MiB of page cache per connection
+            'cache_size': -64000,
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+            # Wait for a competing writer instead of failing with "database is locked"
+            'busy_timeout': int(os.environ.get('DATABASE_BUSY_TIMEOUT', '5000')),
+        },
+    },
+}
 
 
-def init_db():
-    """Call this function to create all tables in the database."""
+def create_engine_for(profile=DATABASE_PROFILE, url=None):
+    """Build an engine configured by one of the named PROFILES."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown database profile {profile!r}, expected one of {', '.join(PROFILES)}")
+
+    options = dict(PROFILES[profile])
+    pragmas = options.pop('pragmas', {})
+    url = url or options.pop('url', DATABASE_URL)
+    options.pop('url', None)
+
+    new_engine = create_engine(url, future=True, **options)
+
+    if pragmas and new_engine.dialect.name == 'sqlite':
+        @event.listens_for(new_engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+
+    return new_engine
+
+
+class RoutingSession(OrmSession):
+    """Session that reads from a replica during read-only requests and uses the primary otherwise.
+
+    A read-only request (see begin_request) sticks to one replica, so all its reads see the same
+    snapshot. Once it writes anything, through a flush or a Core INSERT, UPDATE or DELETE, the
+    rest of the request goes to the primary, which keeps read-your-writes within the request.
+    Outside a read-only request, and when there are no replicas, everything uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._use_primary(clause):
+            return super().get_bind(mapper, clause=clause, **kw)
+
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = self.info['replica'] = replicas[next(_replica_turns) % len(replicas)]
+        return replica
+
+    def _use_primary(self, clause):
+        if not replicas or not getattr(_request, 'read_only', False) or self.info.get('primary'):
+            return True
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['primary'] = True
+            return True
+        return False
+
+
+engine = create_engine_for()
+replicas = [create_engine_for(DATABASE_PROFILE, url) for url in DATABASE_REPLICA_URLS]
+_replica_turns = itertools.count()
+SessionFactory = sessionmaker(bind=engine, class_=RoutingSession, expire_on_commit=False)
+
+# The session of the request being handled on the current thread. Route functions call Session()
+# to get it; the first call opens it and end_request() commits or rolls it back and releases it.
+Session = scoped_session(SessionFactory)
+
+# Whether the request on this thread may read from a replica
+_request = threading.local()
+
+
+def begin_request(read_only=False):
+    """Mark the start of a request on this thread; a read_only one may be served by a replica."""
+    _request.read_only = read_only
+
+
+def read_from_primary():
+    """Send the rest of this request's queries to the primary, e.g. to fill a cache with current data."""
+    Session().info['primary'] = True
+
+
+@contextmanager
+def read_connection():
+    """A connection of its own for a long read that outlives the request's session, such as a streamed export.
+
+    It uses a replica when there are any. Nothing ties it to the thread that opened it.
+    """
+    bind = replicas[next(_replica_turns) % len(replicas)] if replicas else engine
+    with bind.connect() as connection:
+        yield connection
+
+
+def after_commit(callback):
+    """Run callback once the current request's transaction has committed; it is dropped on rollback."""
+    Session().info.setdefault('after_commit', []).append(callback)
+
+
+def end_request(commit):
+    """Commit or roll back the current request's session, if it opened one, and release it."""
+    _request.read_only = False
+    if not Session.registry.has():
+        return
+
+    session = Session()
+    try:
+        callbacks = session.info.pop('after_commit', [])
+        if commit:
+            session.commit()
+            for callback in callbacks:
+                callback()
+        else:
+            session.rollback()
+    finally:
+        Session.remove()
+
+
+@contextmanager
+def request_scope():
+    """Unit of work for code running outside the HTTP dispatcher, such as scripts and benchmarks."""
+    try:
+        yield
+    except BaseException:
+        end_request(commit=False)
+        raise
+    end_request(commit=True)
+
+
+def configure(profile=DATABASE_PROFILE, url=None, replica_urls=()):
+    """Replace the engines behind SessionFactory, e.g. to switch to the test profile."""
+    global engine, replicas
+
+    previous = [engine] + replicas
+    engine = create_engine_for(profile, url)
+    replicas = [create_engine_for(profile, replica_url) for replica_url in replica_urls]
+    SessionFactory.configure(bind=engine)
+    for previous_engine in previous:
+        previous_engine.dispose()
+
+    return engine
+
+
+def after_fork():
+    """Give a forked worker process its own connection pools, leaving the parent's connections alone."""
+    for inherited in [engine] + replicas:
+        # close=False: the parent's connections are only dropped here, never closed under it
+        inherited.dispose(close=False)
+
+
+def init_db(target=None):
+    """Call this function to create all tables in the database, and any columns or indexes missing from existing ones.
+
+    target defaults to the primary engine; pass a replica to set up a local stand-in for one.
+    """
     from .models import Base
-    Base.metadata.create_all(bind=engine)
+    from .aggregates import AGGREGATE_TABLES, rebuild
+    from .search import create_search_index
+    bind = target or engine
+    missing_aggregates = not all(inspect(bind).has_table(name) for name in AGGREGATE_TABLES)
+    Base.metadata.create_all(bind=bind)
+
+    # create_all only builds columns and indexes along with a new table
+    with bind.begin() as connection:
+        existing_tables = inspect(connection)
+        for table in Base.metadata.sorted_tables:
+            existing = {column['name'] for column in existing_tables.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+    with bind.begin() as connection:
+        create_search_index(connection)
+        # An existing database starts its aggregates from the orders it already has
+        if missing_aggregates:
+            rebuild(connection)
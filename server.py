@@ -1,82 +1,119 @@
+from http import HTTPStatus
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
-import json
-from api.user_routes import get_user, create_user, update_user, delete_user
-from api.product_routes import get_product, create_product, update_product, delete_product
-from api.order_routes import get_order, create_order, update_order, delete_order
-from api.order_details_routes import get_order_detail, create_order_detail, update_order_detail, delete_order_detail
+import argparse
+import settings
+import db.session
+from db.query_plans import verify_query_plans
+from web.admission import admission
+from web.app import Request, handle, json_response
+from web.encoding import chunked
+from web.pool import ThreadPoolHTTPServer
 
 
 class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
-
-    def do_GET(self):
-        parsed_path = urlparse(self.path)
-        path_elements = parsed_path.path.split('/')
-
+    # HTTP/1.1 keeps connections open between requests, so every response needs a Content-Length
+    # or chunked transfer encoding
+    protocol_version = 'HTTP/1.1'
+    # Idle keep-alive connections are dropped after this many seconds
+    timeout = settings.KEEPALIVE_TIMEOUT
+    # Headers and body go out as separate writes; on a reused connection Nagle's algorithm would
+    # hold the body back until the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
         try:
-            if path_elements[1] == "users":
-                user_id = path_elements[2]
-                response_content = get_user(user_id)
-
-            elif path_elements[1] == "products":
-                product_id = path_elements[2]
-                response_content = get_product(product_id)
-
-            elif path_elements[1] == "orders":
-                order_id = path_elements[2]
-                response_content = get_order(order_id)
-
-            elif path_elements[1] == "orderdetails":
-                order_detail_id = path_elements[2]
-                response_content = get_order_detail(order_detail_id)
-
-            else:
-                response_content = {"message": "Resource not found"}
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = -1
+        if content_length < 0:
+            # The body's end is unknown, so nothing after it on this connection can be read either
+            self.close_connection = True
+            self._send(json_response(HTTPStatus.BAD_REQUEST, {'error': HTTPStatus.BAD_REQUEST.phrase},
+                                     [('Connection', 'close')]))
+            return
+        body = self.rfile.read(content_length) if content_length else b''
+
+        received = self.server.queued_since() if isinstance(self.server, ThreadPoolHTTPServer) else None
+        self._send(handle(Request(self.command, self.path, self.headers, body, received)))
+
+    def _send(self, response):
+        self.send_response(response.status)
+        for name, value in response.headers:
+            self.send_header(name, value)
+
+        if isinstance(response.body, bytes):
+            if response.status not in (204, 304):
+                self.send_header('Content-Length', str(len(response.body)))
             self.end_headers()
-            self.wfile.write(json.dumps(response_content).encode())
-
-        except Exception as e:
-            self.send_error(500, str(e))
-
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
-        data = json.loads(post_data)
-
-        parsed_path = urlparse(self.path)
-        path_elements = parsed_path.path.split('/')
-
+            self.wfile.write(response.body)
+            return
+
+        # A streamed body of unknown length: chunked for HTTP/1.1 clients, and HTTP/1.0
+        # clients read until the connection closes
+        if self.request_version == 'HTTP/1.1':
+            self.send_header('Transfer-Encoding', 'chunked')
+            chunks = chunked(response.body)
+        else:
+            self.send_header('Connection', 'close')
+            chunks = response.body
+        self.end_headers()
         try:
-            if path_elements[1] == "users":
-                response_content = create_user(data)
-
-            elif path_elements[1] == "products":
-                response_content = create_product(data)
-
-            elif path_elements[1] == "orders":
-                response_content = create_order(data)
-
-            elif path_elements[1] == "orderdetails":
-                response_content = create_order_detail(data)
-
-            else:
-                response_content = {"message": "Resource not found"}
-
-            self.send_response(200)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response_content).encode())
-
+            for chunk in chunks:
+                self.wfile.write(chunk)
         except Exception as e:
-            self.send_error(500, str(e))
-
-    # Additional methods like do_PUT and do_DELETE can be added similarly...
+            # The status line is already sent; cutting the connection is the only way left to
+            # tell the client the body is incomplete
+            self.close_connection = True
+            self.log_error('Streaming response for %s failed: %r', self.path, e)
+
+    do_GET = handle_request
+    do_POST = handle_request
+    do_PUT = handle_request
+    do_DELETE = handle_request
+
+
+def run(host=settings.HOST, port=settings.PORT, workers=settings.WORKERS, queue_size=settings.QUEUE_SIZE):
+    """Serve the API, on a pool of worker threads unless workers is 0."""
+    admission.size_for(workers)
+    if workers > 0:
+        httpd = ThreadPoolHTTPServer((host, port), SimpleHTTPRequestHandler, workers=workers, queue_size=queue_size)
+    else:
+        httpd = HTTPServer((host, port), SimpleHTTPRequestHandler)
+
+    print(f"Server started at http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
 
 
 if __name__ == '__main__':
-    httpd = HTTPServer(('localhost', 8000), SimpleHTTPRequestHandler)
-    print("Server started at http://localhost:8000")
-    httpd.serve_forever()
+    parser = argparse.ArgumentParser(description='Run the merch store API server.')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default=settings.ENGINE,
+                        help='threads serves each connection on a worker thread, '
+                             'asyncio holds connections on an event loop and runs routes on the workers')
+    parser.add_argument('--host', default=settings.HOST)
+    parser.add_argument('--port', type=int, default=settings.PORT)
+    parser.add_argument('--workers', type=int, default=settings.WORKERS,
+                        help='worker threads running requests, 0 to serve one request at a time')
+    parser.add_argument('--queue-size', type=int, default=settings.QUEUE_SIZE,
+                        help='requests allowed to wait for a free worker')
+    parser.add_argument('--processes', type=int, default=settings.PROCESSES,
+                        help='worker processes to fork, each running the chosen engine; 0 serves from this process')
+    args = parser.parse_args()
+
+    db.session.init_db()
+    if settings.CHECK_QUERY_PLANS:
+        verify_query_plans(db.session.engine)
+
+    if args.processes > 0:
+        from web.prefork import Supervisor
+        Supervisor(SimpleHTTPRequestHandler, args.engine, args.host, args.port, args.processes,
+                   args.workers, args.queue_size).run()
+    elif args.engine == 'asyncio':
+        from web.aio import run as run_asyncio
+        run_asyncio(args.host, args.port, args.workers, args.queue_size)
+    else:
+        run(args.host, args.port, args.workers, args.queue_size)
@@ -0,0 +1,91 @@
+import os
+
+# Server configuration, overridable through the environment
+# 'threads' serves each connection on a worker thread, 'asyncio' holds connections on an event loop
+ENGINE = os.environ.get('SERVER_ENGINE', 'threads')
+HOST = os.environ.get('SERVER_HOST', 'localhost')
+PORT = int(os.environ.get('SERVER_PORT', '8000'))
+
+# Number of worker threads running requests; 0 serves one request at a time
+WORKERS = int(os.environ.get('SERVER_WORKERS', '16'))
+# Requests waiting for a free worker before new ones are turned away
+QUEUE_SIZE = int(os.environ.get('SERVER_QUEUE_SIZE', '128'))
+# Seconds an idle keep-alive connection is held open waiting for the next request
+KEEPALIVE_TIMEOUT = float(os.environ.get('SERVER_KEEPALIVE_TIMEOUT', '5'))
+
+# Entities kept by the product and user lookup caches; 0 disables caching
+CACHE_SIZE = int(os.environ.get('CACHE_SIZE', '10000'))
+# Seconds a cached entity stays valid; 0 keeps it until evicted or invalidated by a write
+CACHE_TTL = float(os.environ.get('CACHE_TTL', '300'))
+
+# Rows sent to the database per INSERT by the bulk create endpoints
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '500'))
+# Items accepted in a single bulk create request
+BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', '50000'))
+# Users accepted in a single bulk create request; each one costs a full password hash
+BULK_MAX_USERS = int(os.environ.get('BULK_MAX_USERS', '100'))
+
+# Items returned by list endpoints when no limit is given, and the most a client may ask for
+PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', '50'))
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', '500'))
+
+# Refuse to start when a hot query's plan falls back to a full scan (see db/query_plans.py)
+CHECK_QUERY_PLANS = os.environ.get('CHECK_QUERY_PLANS', '1') == '1'
+
+# Responses smaller than this many bytes are sent uncompressed even when the client accepts gzip
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', '1024'))
+# zlib compression level, 1 (fastest) to 9 (smallest)
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+# List responses with more items than this are streamed with chunked encoding, this many items per chunk
+STREAM_BATCH_ITEMS = int(os.environ.get('STREAM_BATCH_ITEMS', '100'))
+
+# Profiling (see web/profiling.py). Profile this fraction of requests, 0.0 to 1.0
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+# Profile every request to this route pattern, e.g. /products/{product_id:int}
+PROFILE_ROUTE = os.environ.get('PROFILE_ROUTE', '')
+# Requests carrying this value in an X-Profile header are profiled; empty disables the header
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+# Directory receiving one aggregated cProfile stats file per route
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+# Requests slower than this many seconds are logged with their SQL statements; 0 disables the log
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '0.5'))
+
+# scrypt cost parameters for new password hashes; each hash needs 128 * N * R bytes of memory
+PASSWORD_HASH_N = int(os.environ.get('PASSWORD_HASH_N', str(2 ** 14)))
+PASSWORD_HASH_R = int(os.environ.get('PASSWORD_HASH_R', '8'))
+PASSWORD_HASH_P = int(os.environ.get('PASSWORD_HASH_P', '1'))
+# Processes hashing and verifying passwords; 0 hashes on the request thread
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+# Hash jobs allowed in flight at once, kept below WORKERS so signups can't tie up every request thread
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '8'))
+
+# Worker processes forked by the pre-fork supervisor (see web/prefork.py); 0 serves from this process
+PROCESSES = int(os.environ.get('SERVER_PROCESSES', '0'))
+# A worker that has not reported in for this many seconds is killed and replaced
+HEALTH_TIMEOUT = float(os.environ.get('SERVER_HEALTH_TIMEOUT', '10'))
+# Seconds a stopping worker gets to finish its requests before it is killed
+SHUTDOWN_TIMEOUT = float(os.environ.get('SERVER_SHUTDOWN_TIMEOUT', '30'))
+
+# Group commit (see db/group_commit.py): run batched writes from concurrent requests in one transaction
+GROUP_COMMIT = os.environ.get('GROUP_COMMIT', '0') == '1'
+# Seconds the writer waits for more writes after the first one of a batch; longer trades latency for fewer commits
+GROUP_COMMIT_WINDOW = float(os.environ.get('GROUP_COMMIT_WINDOW', '0.002'))
+# Most writes committed together
+GROUP_COMMIT_BATCH_SIZE = int(os.environ.get('GROUP_COMMIT_BATCH_SIZE', '64'))
+# Seconds a request waits for its batch to commit before giving up with an error
+GROUP_COMMIT_TIMEOUT = float(os.environ.get('GROUP_COMMIT_TIMEOUT', '30'))
+
+# Admission control (see web/admission.py). Requests allowed to run at once; 0 leaves the limit to the worker count
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', '0'))
+# Writes (any method but GET) allowed to run at once, so the remaining workers stay free for reads; 0 for no
+# limit. Unset, it is three quarters of the worker threads the server is started with
+ADMISSION_WRITE_LIMIT = int(os.environ['ADMISSION_WRITE_LIMIT']) if os.environ.get('ADMISSION_WRITE_LIMIT') else None
+# Limits for single routes, as comma-separated 'METHOD pattern=limit', e.g. 'POST /orders/checkout=4'
+ADMISSION_ROUTE_LIMITS = os.environ.get('ADMISSION_ROUTE_LIMITS', '')
+# Requests that waited longer than this many seconds for a worker are turned away; 0 serves them however late
+ADMISSION_MAX_QUEUE_SECONDS = float(os.environ.get('ADMISSION_MAX_QUEUE_SECONDS', '5'))
+
+# Rows fetched from the database and written out per chunk by the export endpoints
+EXPORT_BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', '1000'))
+# Exports stop at rows modified this many seconds before they start, so writes still committing land in the next one
+EXPORT_WATERMARK_LAG = float(os.environ.get('EXPORT_WATERMARK_LAG', '5'))
@@ -0,0 +1,35 @@
+import json
+import os
+
+# Must be set before db.session is first imported, so no test ever touches merch_store.db
+os.environ.setdefault('DATABASE_PROFILE', 'test')
+
+import pytest
+
+from api.cache import caches
+from db import session as db_session
+from web.app import Request, handle
+
+
+@pytest.fixture
+def db():
+    """Point SessionFactory at a fresh in-memory database for the duration of a test."""
+    engine = db_session.configure('test')
+    db_session.init_db()
+
+    for cache in caches.values():
+        cache.clear()
+
+    yield engine
+
+
+@pytest.fixture
+def api(db):
+    """Send a request straight through the dispatcher and return (status, decoded body)."""
+    def call(method, path, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b''
+        response = handle(Request(method, path, headers or {}, payload))
+        # Long listings come back as a stream of chunks
+        body = response.body if isinstance(response.body, bytes) else b''.join(response.body)
+        return response.status, json.loads(body) if body else None
+    return call
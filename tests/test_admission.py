@@ -0,0 +1,97 @@
+import json
+import time
+
+import pytest
+
+from web import app
+from web.admission import AdmissionControl, parse_route_limits
+from web.app import Request, handle
+from web.metrics import metrics
+
+
+def test_writes_are_capped_without_blocking_reads():
+    control = AdmissionControl(max_in_flight=0, write_limit=1, route_limits={}, max_queue_seconds=0)
+
+    assert control.admit('POST', '/orders') is None
+    assert control.admit('PUT', '/orders/{order_id:int}') == 'writes'
+    assert control.admit('GET', '/orders') is None
+
+    control.release('POST', '/orders')
+    assert control.admit('PUT', '/orders/{order_id:int}') is None
+
+
+def test_route_and_overall_limits():
+    control = AdmissionControl(max_in_flight=3, write_limit=0, route_limits={('POST', '/orders/checkout'): 1},
+                               max_queue_seconds=0)
+
+    assert control.admit('POST', '/orders/checkout') is None
+    assert control.admit('POST', '/orders/checkout') == 'route'
+    assert control.admit('GET', '/products') is None
+    assert control.admit('GET', '/products') is None
+    assert control.admit('GET', '/products') == 'in_flight'
+    # Metrics stay reachable however busy the server is
+    assert control.admit('GET', '/metrics') is None
+
+    control.release('POST', '/orders/checkout')
+    control.release('GET', '/metrics')
+    assert control.in_flight == 2
+    assert control.admit('POST', '/orders/checkout') is None
+
+
+def test_requests_that_waited_too_long_are_shed():
+    control = AdmissionControl(max_in_flight=0, write_limit=0, route_limits={}, max_queue_seconds=1)
+
+    assert control.admit('GET', '/products', time.monotonic() - 2) == 'queue_timeout'
+    assert control.in_flight == 0
+    assert control.admit('GET', '/products', time.monotonic()) is None
+
+
+def test_parse_route_limits():
+    assert parse_route_limits('post /orders/checkout=4, GET /products/search = 8,') == {
+        ('POST', '/orders/checkout'): 4, ('GET', '/products/search'): 8}
+    with pytest.raises(ValueError):
+        parse_route_limits('/orders=4')
+
+
+def test_shed_request_gets_fast_503_and_is_counted(api, monkeypatch):
+    monkeypatch.setattr(app, 'admission', AdmissionControl(max_in_flight=0, write_limit=0, route_limits={},
+                                                           max_queue_seconds=1))
+    metrics.clear()
+
+    response = handle(Request('GET', '/products', {}, received=time.monotonic() - 5))
+
+    assert response.status == 503
+    assert ('Retry-After', '1') in response.headers
+    assert json.loads(response.body) == {'error': 'Server is too busy, please retry'}
+    assert app.admission.in_flight == 0
+
+    lines = handle(Request('GET', '/metrics', {})).body.decode().splitlines()
+    assert 'http_requests_shed_total{route="/products",reason="queue_timeout"} 1' in lines
+    assert 'http_requests_total{method="GET",route="/products",status="503"} 1' in lines
+
+
+def test_default_write_limit_follows_the_workers_started(monkeypatch):
+    import settings
+
+    monkeypatch.setattr(settings, 'WORKERS', 16)
+    control = AdmissionControl(write_limit=None, route_limits={})
+    assert control.write_limit == 12
+
+    control.size_for(4)
+    assert control.write_limit == 3
+    control.size_for(1)
+    assert control.write_limit == 1
+
+    explicit = AdmissionControl(write_limit=5, route_limits={})
+    explicit.size_for(4)
+    assert explicit.write_limit == 5
+
+
+def test_async_server_sizes_admission_for_its_workers(monkeypatch):
+    from web.aio import AsyncHTTPServer
+
+    control = AdmissionControl(write_limit=None, route_limits={})
+    monkeypatch.setattr('web.aio.admission', control)
+
+    AsyncHTTPServer('localhost', 0, workers=4).executor.shutdown()
+    assert control.write_limit == 3
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import text
+
+from db.aggregates import rebuild, verify
+from db.session import init_db
+
+
+def _shop(api):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    mug_id = api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 20})[1]['id']
+    cap_id = api('POST', '/products', {'name': 'Cap', 'price': 12.5, 'stock': 20})[1]['id']
+    return user_id, mug_id, cap_id
+
+
+def test_stats_follow_every_write_path(api, db):
+    user_id, mug_id, cap_id = _shop(api)
+    assert api('GET', f'/users/{user_id}/stats') == (200, {'user_id': user_id, 'order_count': 0, 'total_spent': 0.0})
+
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 10.0})[1]['id']
+    api('PUT', f'/orders/{order_id}', {'total': 15.0})
+    detail_id = api('POST', '/orderdetails', {'order_id': order_id, 'product_id': mug_id, 'quantity': 2})[1]['id']
+    api('PUT', f'/orderdetails/{detail_id}', {'quantity': 3})
+    api('POST', '/orderdetails/bulk', [{'order_id': order_id, 'product_id': cap_id, 'quantity': 1},
+                                        {'order_id': order_id, 'product_id': cap_id, 'quantity': 2}])
+    api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': mug_id, 'quantity': 1}]})
+    doomed_id = api('POST', '/orders', {'user_id': user_id, 'total': 99.0})[1]['id']
+    api('POST', '/orderdetails', {'order_id': doomed_id, 'product_id': cap_id, 'quantity': 5})
+    api('DELETE', f'/orders/{doomed_id}')
+    doomed_detail_id = api('POST', '/orderdetails', {'order_id': order_id, 'product_id': mug_id, 'quantity': 4})[1]['id']
+    api('DELETE', f'/orderdetails/{doomed_detail_id}')
+
+    assert api('GET', f'/users/{user_id}/stats')[1] == {'user_id': user_id, 'order_count': 2, 'total_spent': 20.0}
+    assert api('GET', f'/products/{mug_id}/stats')[1] == {'product_id': mug_id, 'units_sold': 4, 'revenue': 20.0}
+    assert api('GET', f'/products/{cap_id}/stats')[1] == {'product_id': cap_id, 'units_sold': 3, 'revenue': 37.5}
+    with db.connect() as connection:
+        assert verify(connection) == []
+
+
+def test_failed_write_leaves_stats_alone(api):
+    user_id, mug_id, _ = _shop(api)
+
+    status, _ = api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': mug_id, 'quantity': 50}]})
+
+    assert status == 409
+    assert api('GET', f'/users/{user_id}/stats')[1]['order_count'] == 0
+    assert api('GET', f'/products/{mug_id}/stats')[1]['units_sold'] == 0
+
+
+@pytest.mark.parametrize('quantity', [-3, 0, 1.5, True, None])
+def test_invalid_quantity_leaves_sales_alone(api, quantity):
+    user_id, mug_id, _ = _shop(api)
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 5.0})[1]['id']
+    detail_id = api('POST', '/orderdetails', {'order_id': order_id, 'product_id': mug_id, 'quantity': 1})[1]['id']
+    error = (400, {'error': 'quantity must be a positive integer'})
+
+    assert api('POST', '/orderdetails', {'order_id': order_id, 'product_id': mug_id, 'quantity': quantity}) == error
+    if quantity is not None:
+        assert api('PUT', f'/orderdetails/{detail_id}', {'quantity': quantity}) == error
+
+    assert api('GET', f'/orderdetails/{detail_id}')[1]['quantity'] == 1
+    assert api('GET', f'/products/{mug_id}/stats')[1] == {'product_id': mug_id, 'units_sold': 1, 'revenue': 5.0}
+
+
+@pytest.mark.parametrize('path', ['/users/99/stats', '/products/99/stats'])
+def test_stats_of_missing_row_is_404(api, path):
+    assert api('GET', path)[0] == 404
+
+
+def test_verify_finds_drift_and_rebuild_repairs_it(api, db):
+    user_id, mug_id, _ = _shop(api)
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 10.0})[1]['id']
+    api('POST', '/orderdetails', {'order_id': order_id, 'product_id': mug_id, 'quantity': 2})
+
+    with db.begin() as connection:
+        # Writes that bypass the routes don't touch the aggregates
+        connection.execute(text(f"INSERT INTO orders (user_id, total, created_at) VALUES ({user_id}, 5.0, '2024-01-01')"))
+        connection.execute(text('DELETE FROM product_stats'))
+        assert verify(connection) == [('user_stats', user_id, (1, 10.0), (2, 15.0)),
+                                      ('product_stats', mug_id, (0, 0.0), (2, 10.0))]
+        rebuild(connection)
+        assert verify(connection) == []
+
+    assert api('GET', f'/users/{user_id}/stats')[1]['total_spent'] == 15.0
+
+
+def test_init_db_fills_new_aggregate_tables(api, db):
+    user_id, _, _ = _shop(api)
+    api('POST', '/orders', {'user_id': user_id, 'total': 10.0})
+    with db.begin() as connection:
+        connection.execute(text('DROP TABLE user_stats'))
+
+    init_db()
+
+    assert api('GET', f'/users/{user_id}/stats')[1]['order_count'] == 1
@@ -3,10 +3,11 @@ import json
 from http.client import HTTPConnection
 from server import SimpleHTTPRequestHandler, HTTPServer
 from db.base import Base, engine
-from db.session import SessionFactory
+from db.session import Session
 import threading
 
-# Global variable for the server thread
+# Global variables for the server and its thread
+httpd = None
 server_thread = None
 
 # Use an in-memory SQLite database for testing
@@ -18,16 +19,18 @@ def setup_module():
     # Create tables
     Base.metadata.create_all(engine)
 
-    global server_thread
+    global httpd, server_thread
     server_address = ('', 8001)
     httpd = HTTPServer(server_address, SimpleHTTPRequestHandler)
-    server_thread = threading.Thread(target=httpd.serve_forever)
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
     server_thread.start()
 
 
 def teardown_module():
     """Stop the server after tests."""
-    global server_thread
+    if httpd:
+        httpd.shutdown()
+        httpd.server_close()
     if server_thread:
         server_thread.join(timeout=1)
 
@@ -52,10 +55,8 @@ def client():
 
 @pytest.fixture(autouse=True)  # autouse ensures that it's used automatically without explicit invocation
 def handle_sessions():
-    SessionFactory.begin_nested()  # start a transaction
     yield
-    SessionFactory.rollback()  # rollback the transaction after test
-    SessionFactory.close()  # close the session
+    Session.remove()  # roll back and release any session the test opened on this thread
 
 
 # Individual Test Functions
@@ -71,7 +72,7 @@ def test_create_user(client):
     client.request('POST', '/users', body=json.dumps(user_data), headers=headers)
     response = client.getresponse()
 
-    assert response.status == 200
+    assert response.status == 201
 
     response_data = json.loads(response.read().decode())
     assert 'id' in response_data
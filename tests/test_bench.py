@@ -0,0 +1,45 @@
+from sqlalchemy import select
+
+from bench import results
+from bench.seed import seed
+from db import session as db_session
+from db.aggregates import verify
+from db.models import Order
+from db.session import SessionFactory
+
+
+def _order_totals():
+    with SessionFactory() as session:
+        return session.scalars(select(Order.total).order_by(Order.id)).all()
+
+
+def test_seed_is_reproducible(db):
+    counts = seed(users=20, products=10, orders=30, details=2, seed=7)
+    totals = _order_totals()
+
+    assert counts == {'users': 20, 'products': 10, 'orders': 30, 'order_details': 60}
+    with db.connect() as connection:
+        assert verify(connection) == []
+
+    db_session.configure('test')
+    db_session.init_db()
+    seed(users=20, products=10, orders=30, details=2, seed=7)
+    assert _order_totals() == totals
+
+
+def test_summary_percentiles():
+    summary = results.summarize([n / 1000 for n in range(1, 101)], elapsed=2.0)
+
+    assert summary['count'] == 100
+    assert summary['p50'] == 50
+    assert summary['p99'] == 99
+    assert summary['throughput'] == 50
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {'get_product': {'p99': 10.0, 'throughput': 1000.0}}
+    current = {'get_product': {'p99': 10.5, 'throughput': 800.0}}
+
+    rows = {metric: regressed for _, metric, _, _, _, regressed in results.compare(current, baseline, 0.10)}
+
+    assert rows == {'p99': False, 'throughput': True}
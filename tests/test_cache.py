@@ -0,0 +1,87 @@
+from api.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hit_after_first_load():
+    cache = LRUCache('test-hits', maxsize=10)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return {'id': 1}
+
+    assert cache.get_or_load(1, load) == {'id': 1}
+    assert cache.get_or_load(1, load) == {'id': 1}
+    assert len(loads) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 10}
+
+
+def test_missing_values_are_not_cached():
+    cache = LRUCache('test-missing', maxsize=10)
+
+    assert cache.get_or_load(1, lambda: None) is None
+    assert cache.get_or_load(1, lambda: {'id': 1}) == {'id': 1}
+    assert cache.misses == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache('test-lru', maxsize=2)
+    cache.get_or_load(1, lambda: 'one')
+    cache.get_or_load(2, lambda: 'two')
+    cache.get_or_load(1, lambda: 'unused')  # 1 is now the most recently used
+    cache.get_or_load(3, lambda: 'three')
+
+    assert cache.get_or_load(1, lambda: 'reloaded') == 'one'
+    assert cache.get_or_load(2, lambda: 'reloaded') == 'reloaded'
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = LRUCache('test-ttl', maxsize=10, ttl=30, clock=clock)
+    cache.get_or_load(1, lambda: 'old')
+
+    clock.now = 29
+    assert cache.get_or_load(1, lambda: 'new') == 'old'
+    clock.now = 31
+    assert cache.get_or_load(1, lambda: 'new') == 'new'
+
+
+def test_invalidate_drops_entry():
+    cache = LRUCache('test-invalidate', maxsize=10)
+    cache.get_or_load(1, lambda: 'old')
+    cache.invalidate(1)
+
+    assert cache.get_or_load(1, lambda: 'new') == 'new'
+
+
+def test_load_racing_with_invalidation_is_not_stored():
+    cache = LRUCache('test-race', maxsize=10)
+
+    def load():
+        # A write lands while the row is being read
+        cache.invalidate(1)
+        return 'stale'
+
+    assert cache.get_or_load(1, load) == 'stale'
+    assert cache.get_or_load(1, lambda: 'fresh') == 'fresh'
+
+
+def test_invalidation_in_forked_process_reaches_parent():
+    import multiprocessing
+
+    cache = LRUCache('test-shared', maxsize=10)
+    cache.get_or_load(1, lambda: 'old')
+
+    child = multiprocessing.get_context('fork').Process(target=cache.invalidate, args=(2,))
+    child.start()
+    child.join()
+
+    assert cache.get_or_load(1, lambda: 'new') == 'new'
+    assert cache.get_or_load(1, lambda: 'newer') == 'new'
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+
+import pytest
+
+import settings
+from web.app import Request, handle
+
+
+@pytest.fixture
+def orders(api, monkeypatch):
+    monkeypatch.setattr(settings, 'EXPORT_BATCH_ROWS', 2)
+    monkeypatch.setattr(settings, 'EXPORT_WATERMARK_LAG', 0)
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    return [api('POST', '/orders', {'user_id': user_id, 'total': float(n)})[1]['id'] for n in range(5)]
+
+
+def _export(path):
+    response = handle(Request('GET', path, {}))
+    headers = dict(response.headers)
+    if response.status != 200:
+        return response.status, headers, json.loads(response.body)
+    chunks = list(response.body)
+    return response.status, headers, chunks
+
+
+def test_orders_are_streamed_as_ndjson_in_batches(orders):
+    status, headers, chunks = _export('/exports/orders')
+
+    assert status == 200
+    assert headers['Content-Type'] == 'application/x-ndjson'
+    # Five rows, two per chunk
+    assert len(chunks) == 3
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert [row['id'] for row in rows] == orders
+    assert rows[0]['total'] == 0.0 and rows[0]['updated_at']
+
+
+def test_order_details_are_exported_as_csv(api, orders):
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 9})[1]['id']
+    api('POST', '/orderdetails', {'order_id': orders[0], 'product_id': product_id, 'quantity': 3})
+
+    status, headers, chunks = _export('/exports/orderdetails?format=csv')
+
+    assert headers['Content-Type'] == 'text/csv; charset=utf-8'
+    rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode())))
+    assert len(rows) == 1
+    assert rows[0]['order_id'] == str(orders[0]) and rows[0]['sub_total'] == '15.0'
+
+
+def test_empty_csv_export_has_just_the_header(db):
+    status, _, chunks = _export('/exports/orders?format=csv')
+
+    assert status == 200
+    assert b''.join(chunks).decode().splitlines() == ['id,user_id,total,created_at,updated_at,version']
+
+
+def test_since_watermark_exports_only_later_changes(api, orders):
+    _, headers, _ = _export('/exports/orders')
+    watermark = headers['X-Export-Watermark']
+
+    api('PUT', f'/orders/{orders[1]}', {'total': 42.0})
+    _, headers, chunks = _export(f'/exports/orders?since={watermark}')
+
+    rows = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+    assert [(row['id'], row['total']) for row in rows] == [(orders[1], 42.0)]
+    assert headers['X-Export-Watermark'] > watermark
+
+
+@pytest.mark.parametrize('query, error', [('format=xml', 'format must be one of ndjson, csv'),
+                                          ('since=yesterday', 'since must be an ISO 8601 date and time')])
+def test_bad_export_arguments_are_400(db, query, error):
+    assert _export(f'/exports/orders?{query}') == (400, {'Content-Type': 'application/json'}, {'error': error})
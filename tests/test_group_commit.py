@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+import settings
+from db import group_commit
+from db.group_commit import GroupCommitter
+from web.app import Request, handle
+
+
+@pytest.fixture
+def committer(monkeypatch):
+    committer = GroupCommitter(window=0.2, batch_size=8)
+    monkeypatch.setattr(settings, 'GROUP_COMMIT', True)
+    monkeypatch.setattr(group_commit, 'group_committer', committer)
+    return committer
+
+
+def _post_concurrently(requests):
+    responses = [None] * len(requests)
+
+    def send(index, path, body):
+        responses[index] = handle(Request('POST', path, {}, body.encode()))
+
+    threads = [threading.Thread(target=send, args=(index, path, body)) for index, (path, body) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_concurrent_writes_share_a_commit_and_keep_their_own_results(api, committer):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 9})[1]['id']
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 0})[1]['id']
+    committer.batches = committer.writes = 0
+
+    responses = _post_concurrently(
+        [('/orderdetails', f'{{"order_id": {order_id}, "product_id": {product_id}, "quantity": {n}}}')
+         for n in range(1, 6)]
+        # Refers to an order that doesn't exist; fails alone
+        + [('/orderdetails', f'{{"order_id": 999, "product_id": {product_id}, "quantity": 1}}')]
+    )
+
+    assert [response.status for response in responses] == [201] * 5 + [400]
+    assert committer.writes == 6
+    assert committer.batches < 6
+
+    status, body = api('GET', f'/orderdetails?order_id={order_id}')
+    assert sorted(item['quantity'] for item in body['items']) == [1, 2, 3, 4, 5]
+
+
+def test_failed_commit_fails_every_write_in_the_batch(api, committer, monkeypatch):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+
+    def fail(commit):
+        group_commit.Session.remove()
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(group_commit, 'end_request', fail)
+    responses = _post_concurrently([('/orders', f'{{"user_id": {user_id}, "total": 1.0}}')] * 2)
+
+    assert [response.status for response in responses] == [500, 500]
+    monkeypatch.undo()
+    assert api('GET', '/orders')[1]['items'] == []
+
+
+def test_writer_survives_a_batch_that_cannot_start(api, committer, monkeypatch):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    begin = group_commit._begin
+    failures = [RuntimeError('database is locked')]
+
+    def flaky_begin(session):
+        if failures:
+            raise failures.pop()
+        begin(session)
+
+    monkeypatch.setattr(group_commit, '_begin', flaky_begin)
+    monkeypatch.setattr(settings, 'GROUP_COMMIT_TIMEOUT', 5)
+
+    assert _post_concurrently([('/orders', f'{{"user_id": {user_id}, "total": 1.0}}')])[0].status == 500
+    # The writer thread is still there for the next write
+    assert _post_concurrently([('/orders', f'{{"user_id": {user_id}, "total": 2.0}}')])[0].status == 201
+    assert [order['total'] for order in api('GET', '/orders')[1]['items']] == [2.0]
+
+
+def test_write_that_times_out_is_never_committed(api, monkeypatch):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    # The writer waits out its window before starting the batch, long after the caller gave up
+    committer = GroupCommitter(window=0.5, batch_size=8)
+    monkeypatch.setattr(settings, 'GROUP_COMMIT', True)
+    monkeypatch.setattr(settings, 'GROUP_COMMIT_TIMEOUT', 0.1)
+    monkeypatch.setattr(group_commit, 'group_committer', committer)
+
+    assert _post_concurrently([('/orders', f'{{"user_id": {user_id}, "total": 1.0}}')])[0].status == 500
+    time.sleep(1)
+
+    assert committer.writes == 0
+    monkeypatch.undo()
+    assert api('GET', '/orders')[1]['items'] == []
@@ -0,0 +1,49 @@
+from web.app import Request, handle
+from web.metrics import Histogram, Metrics, metrics
+
+
+def _scrape():
+    response = handle(Request('GET', '/metrics', {}))
+    assert response.status == 200
+    assert response.headers[0][1].startswith('text/plain; version=0.0.4')
+    return response.body.decode().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Metrics()
+    for seconds in (0.0005, 0.003, 0.003, 20.0):
+        registry.record('GET', '/things', 200, seconds, 1, 0.0)
+
+    lines = registry.render().decode().splitlines()
+
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/things",status="200",le="0.001"} 1' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/things",status="200",le="0.005"} 3' in lines
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/things",status="200",le="+Inf"} 4' in lines
+    assert 'http_request_duration_seconds_count{method="GET",route="/things",status="200"} 4' in lines
+
+
+def test_histogram_bound_is_inclusive():
+    histogram = Histogram((1, 2))
+    histogram.observe(1)
+    histogram.observe(3)
+
+    assert histogram.counts == [1, 0, 1]
+
+
+def test_requests_are_labelled_by_route_and_count_queries(api):
+    metrics.clear()
+    api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 3})
+    api('GET', '/products/1')
+    api('GET', '/products/1')
+    api('GET', '/products/999')
+    api('GET', '/nowhere')
+
+    lines = _scrape()
+
+    assert 'http_requests_total{method="GET",route="/products/{product_id:int}",status="200"} 2' in lines
+    assert 'http_requests_total{method="GET",route="/products/{product_id:int}",status="404"} 1' in lines
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"} 1' in lines
+    # The second read of product 1 was served from the cache without touching the database
+    assert 'db_queries_per_request_bucket{route="/products/{product_id:int}",le="0"} 1' in lines
+    assert 'db_queries_per_request_count{route="/products/{product_id:int}"} 3' in lines
+    assert 'cache_hits_total{cache="products"} 1' in lines
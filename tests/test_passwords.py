@@ -0,0 +1,53 @@
+import settings
+from api import passwords
+
+
+def test_hash_verifies_and_is_salted():
+    encoded = passwords.hash_password('correct horse')
+
+    assert encoded.startswith(f'scrypt${settings.PASSWORD_HASH_N}$')
+    assert passwords.verify_password('correct horse', encoded)
+    assert not passwords.verify_password('wrong horse', encoded)
+    assert passwords.hash_password('correct horse') != encoded
+
+
+def test_bulk_hashes_keep_order(monkeypatch):
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_N', 2 ** 10)
+
+    hashes = passwords.hash_passwords(['a', 'b', 'c'])
+
+    assert [passwords.verify_password(password, encoded) for password, encoded in zip('abc', hashes)] == [True] * 3
+
+
+def test_cost_change_needs_rehash(monkeypatch):
+    encoded = passwords.hash_password('pw')
+    assert not passwords.needs_rehash(encoded)
+
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_N', 2 ** 15)
+    assert passwords.needs_rehash(encoded)
+    assert passwords.verify_password('pw', encoded)
+    # Passwords stored before hashing still verify, and are due for a hash
+    assert passwords.verify_password('legacy', 'legacy') and passwords.needs_rehash('legacy')
+
+
+def test_full_pool_is_reported_busy(api, monkeypatch):
+    monkeypatch.setattr(passwords, '_pending', passwords.threading.BoundedSemaphore(1))
+    passwords._pending.acquire()
+
+    status, body = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})
+
+    assert status == 503
+    assert 'retry' in body['error']
+
+
+def test_stored_password_is_hashed(api, db):
+    from db.models import User
+    from db.session import SessionFactory
+
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    api('PUT', f'/users/{user_id}', {'password': 'new'})
+
+    with SessionFactory() as session:
+        stored = session.get(User, user_id).password
+    assert stored != 'new' and passwords.verify_password('new', stored)
+    assert api('PUT', f'/users/{user_id}', {'password': 42})[0] == 400
@@ -0,0 +1,172 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        return {int(child) for child in f.read().split()}
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@pytest.fixture(params=['threads', 'asyncio'])
+def supervisor(request, tmp_path):
+    if not os.path.exists(f'/proc/{os.getpid()}/task/{os.getpid()}/children'):
+        pytest.skip('needs /proc to find the worker processes')
+
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, DATABASE_PROFILE='prod', DATABASE_URL=f"sqlite:///{tmp_path / 'store.db'}",
+               SERVER_HEALTH_TIMEOUT='5', SERVER_SHUTDOWN_TIMEOUT='5', PASSWORD_HASH_WORKERS='0')
+    process = subprocess.Popen(
+        [sys.executable, 'server.py', '--processes', '2', '--workers', '2', '--engine', request.param,
+         '--port', str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    assert _wait_for(lambda: len(_children(process.pid)) == 2 and _get(port, '/products')[0] == 200)
+
+    yield process, port
+
+    if process.poll() is None:
+        workers = _children(process.pid)
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            # Workers first: killed on its own, the supervisor would leave them serving the port
+            for pid in workers | _children(process.pid):
+                _kill(pid)
+            process.kill()
+            process.wait()
+
+
+def _kill(pid):
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _alive(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # A zombie has exited and is only waiting to be reaped
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def _get(port, path):
+    try:
+        conn = HTTPConnection('localhost', port, timeout=5)
+        conn.request('GET', path)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response.status, body
+    except OSError:
+        return None, None
+
+
+def test_workers_share_the_port_and_are_replaced(supervisor):
+    process, port = supervisor
+    conn = HTTPConnection('localhost', port, timeout=5)
+    conn.request('POST', '/products', body=json.dumps({'name': 'Mug', 'price': 5.0, 'stock': 1}))
+    assert conn.getresponse().status == 201
+    conn.close()
+
+    workers = _children(process.pid)
+    os.kill(next(iter(workers)), signal.SIGKILL)
+
+    assert _wait_for(lambda: len(_children(process.pid) - workers) == 1)
+    assert _wait_for(lambda: _get(port, '/products/1')[0] == 200)
+
+
+def test_sighup_replaces_every_worker_and_sigterm_stops(supervisor):
+    process, port = supervisor
+    workers = _children(process.pid)
+
+    process.send_signal(signal.SIGHUP)
+    assert _wait_for(lambda: not (_children(process.pid) & workers) and len(_children(process.pid)) == 2)
+    assert _get(port, '/products')[0] == 200
+
+    process.send_signal(signal.SIGTERM)
+    assert process.wait(timeout=10) == 0
+
+
+def test_sighup_under_load_drops_no_requests(supervisor):
+    process, port = supervisor
+    failures = []
+    served = []
+    done = threading.Event()
+
+    def client():
+        # A new connection per request, so some wait in a listen backlog while workers are retired
+        while not done.is_set():
+            status, _ = _get(port, '/products')
+            (served if status == 200 else failures).append(status)
+
+    clients = [threading.Thread(target=client) for _ in range(8)]
+    for thread in clients:
+        thread.start()
+    try:
+        for _ in range(3):
+            workers = _children(process.pid)
+            process.send_signal(signal.SIGHUP)
+            assert _wait_for(lambda: not (_children(process.pid) & workers) and len(_children(process.pid)) == 2)
+    finally:
+        done.set()
+        for thread in clients:
+            thread.join()
+
+    assert served
+    assert failures == []
+
+
+def test_workers_exit_when_the_supervisor_is_killed(supervisor):
+    process, port = supervisor
+    workers = _children(process.pid)
+
+    process.kill()
+    process.wait()
+
+    assert _wait_for(lambda: not any(_alive(pid) for pid in workers))
+    assert _get(port, '/products')[0] is None
+
+
+def test_sigterm_lets_requests_in_flight_finish(supervisor):
+    process, port = supervisor
+    body = json.dumps({'name': 'Mug', 'price': 5.0, 'stock': 1}).encode()
+
+    with socket.create_connection(('localhost', port), timeout=10) as sock:
+        # A worker takes the request and waits for the rest of its body
+        sock.sendall(b'POST /products HTTP/1.1\r\nHost: localhost\r\n'
+                     b'Content-Length: %d\r\n\r\n' % len(body) + body[:5])
+        time.sleep(0.5)
+        process.send_signal(signal.SIGTERM)
+        # Longer than a worker used to wait for its requests before exiting
+        time.sleep(2)
+        sock.sendall(body[5:])
+
+        assert sock.recv(1024).startswith(b'HTTP/1.1 201')
+
+    assert process.wait(timeout=10) == 0
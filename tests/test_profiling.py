@@ -0,0 +1,46 @@
+import logging
+import pstats
+
+import settings
+from web import profiling
+
+
+def test_route_is_profiled_into_stats_file(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(settings, 'PROFILE_ROUTE', '/products/{product_id:int}')
+    monkeypatch.setattr(profiling, '_stats', {})
+
+    api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 3})
+    api('GET', '/products/1')
+    api('GET', '/products/1')
+
+    stats = pstats.Stats(profiling.stats_path('GET', '/products/{product_id:int}'))
+    calls = {function[2]: counts[1] for function, counts in stats.stats.items()}
+    assert calls['get_product'] == 2
+    assert not (tmp_path / 'POST_products.prof').exists()
+
+
+def test_profile_header_needs_the_token(api, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(settings, 'PROFILE_TOKEN', 'secret')
+    monkeypatch.setattr(profiling, '_stats', {})
+
+    api('GET', '/users', headers={'X-Profile': 'guess'})
+    # http.server decodes header bytes as latin-1, so any non-ASCII byte arrives as a character like this
+    assert api('GET', '/users', headers={'X-Profile': '\xe9'})[0] == 200
+    assert not list(tmp_path.iterdir())
+
+    api('GET', '/users', headers={'X-Profile': 'secret'})
+    assert [path.name for path in tmp_path.iterdir()] == ['GET_users.prof']
+
+
+def test_slow_request_is_logged_with_its_sql(api, monkeypatch, caplog):
+    api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 3})
+    monkeypatch.setattr(settings, 'SLOW_REQUEST_SECONDS', 1e-9)
+
+    with caplog.at_level(logging.WARNING, logger='slow_requests'):
+        api('GET', '/products?limit=5')
+
+    (record,) = caplog.records
+    assert record.getMessage().startswith('GET /products -> 200 took')
+    assert 'SELECT products.id' in record.getMessage()
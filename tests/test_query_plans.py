@@ -0,0 +1,20 @@
+import pytest
+from sqlalchemy import text
+
+from db.query_plans import QueryPlanError, check_query_plans, verify_query_plans
+
+
+def test_hot_queries_use_indexes(db):
+    assert check_query_plans(db) == {}
+    verify_query_plans(db)
+
+
+def test_missing_index_fails_loudly(db):
+    with db.begin() as connection:
+        connection.execute(text('DROP INDEX ix_order_details_order_id'))
+
+    with pytest.raises(QueryPlanError) as excinfo:
+        verify_query_plans(db)
+
+    assert 'order details of an order' in str(excinfo.value)
+    assert 'SCAN order_details' in str(excinfo.value)
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import select
+
+from api.cache import caches
+from db import session as db_session
+from db.models import Product
+
+
+@pytest.fixture
+def replicated(db, tmp_path):
+    """A primary and a replica stand-in, two separate SQLite files with nothing replicating between them."""
+    db_session.configure('test', f"sqlite:///{tmp_path / 'primary.db'}", [f"sqlite:///{tmp_path / 'replica.db'}"])
+    db_session.init_db()
+    db_session.init_db(db_session.replicas[0])
+    for cache in caches.values():
+        cache.clear()
+
+    yield db_session.replicas[0]
+
+    db_session.configure('test')
+
+
+def test_gets_read_from_the_replica(replicated, api):
+    user_id = api('POST', '/users', {'username': 'u', 'email': 'u@example.com', 'password': 'pw'})[1]['id']
+    status, order = api('POST', '/orders', {'user_id': user_id, 'total': 5.0})
+    assert status == 201
+
+    # Not replicated yet
+    assert api('GET', f"/orders/{order['id']}")[0] == 404
+    assert api('GET', '/orders')[1]['items'] == []
+
+    with replicated.begin() as connection:
+        connection.exec_driver_sql(
+            "INSERT INTO orders (id, user_id, total, created_at, version) VALUES (?, ?, 5.0, '2024-01-01 00:00:00', 1)",
+            (order['id'], user_id))
+    assert api('GET', f"/orders/{order['id']}")[0] == 200
+
+
+def test_request_reads_its_own_writes(replicated):
+    db_session.begin_request(read_only=True)
+    session = db_session.Session()
+    assert session.get_bind() is replicated
+
+    session.add(Product(name='Mug', price=5.0, stock=1))
+    session.flush()
+
+    assert session.scalar(select(Product.name)) == 'Mug'
+    db_session.end_request(commit=True)
+
+    db_session.begin_request(read_only=True)
+    assert db_session.Session().scalar(select(Product.name)) is None
+    db_session.end_request(commit=True)
+
+
+def test_cache_fills_from_the_primary(replicated, api):
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 5.0, 'stock': 1})[1]['id']
+
+    assert api('GET', f'/products/{product_id}')[1]['name'] == 'Mug'
@@ -0,0 +1,419 @@
+import json
+
+from web.app import Request, handle
+
+
+def test_bulk_create_products(api):
+    items = [{'name': f'Shirt {n}', 'price': 10.0 + n, 'stock': n} for n in range(5)]
+
+    status, body = api('POST', '/products/bulk', items)
+
+    assert status == 201
+    assert body['count'] == 5
+    assert api('GET', f"/products/{body['ids'][3]}")[1]['name'] == 'Shirt 3'
+
+
+def test_bulk_create_reports_every_malformed_item(api):
+    status, body = api('POST', '/products/bulk', [
+        {'name': 'Shirt', 'price': 10.0, 'stock': 1},
+        {'name': 'Mug'},
+        {'name': 'Cap', 'price': None, 'stock': 2.5},
+        'Hat',
+    ])
+
+    assert status == 400
+    assert body == {'error': '3 items rejected, nothing was created', 'errors': [
+        {'index': 1, 'error': 'missing price, stock'},
+        {'index': 2, 'error': 'price must be a non-negative number; stock must be a non-negative integer'},
+        {'index': 3, 'error': 'not an object'},
+    ]}
+    assert api('GET', '/products')[1]['items'] == []
+    assert api('POST', '/products/bulk', {'name': 'Shirt'}) == (400, {'error': 'Expected a non-empty JSON array of items'})
+
+
+def test_bulk_create_users_is_all_or_nothing(api):
+    api('POST', '/users', {'username': 'taken', 'email': 'taken@example.com', 'password': 'secret'})
+
+    status, body = api('POST', '/users/bulk', [
+        {'username': 'fresh', 'email': 'fresh@example.com', 'password': 'secret'},
+        {'username': 'taken', 'email': 'other@example.com', 'password': 'secret'},
+        {'username': 'twin', 'email': 'fresh@example.com', 'password': 'secret'},
+    ])
+
+    assert status == 409
+    assert body['errors'] == [
+        {'index': 1, 'error': "username 'taken' is already taken"},
+        {'index': 2, 'error': "email 'fresh@example.com' appears earlier in the request"},
+    ]
+    status, body = api('POST', '/users/bulk', [{'username': 'fresh', 'email': 'fresh@example.com', 'password': 'x'}])
+    assert status == 201
+    assert len(body['user_ids']) == 1
+    status, body = api('POST', '/users/bulk', [{'username': 'u', 'email': 'u@example.com', 'password': 1},
+                                               {'username': 'fresh', 'email': 'new@example.com', 'password': 'x'}])
+    assert status == 400
+    assert body['errors'] == [{'index': 0, 'error': 'password must be a string'},
+                              {'index': 1, 'error': "username 'fresh' is already taken"}]
+
+
+def test_duplicate_or_missing_username_answers_409(api, monkeypatch):
+    monkeypatch.setattr('settings.BULK_MAX_USERS', 2)
+    api('POST', '/users', {'username': 'taken', 'email': 'taken@example.com', 'password': 'secret'})
+
+    for method, path, data in [
+        ('POST', '/users', {'username': 'taken', 'email': 'new@example.com', 'password': 'secret'}),
+        ('PUT', '/users/1', {'username': None, 'password': 'x'}),
+    ]:
+        assert api(method, path, data) == (409, {'status': 'error',
+                                                 'message': 'A username or email is missing or already taken'})
+    assert api('GET', '/users/1')[1]['username'] == 'taken'
+
+    users = [{'username': f'u{n}', 'email': f'u{n}@example.com', 'password': 'x'} for n in range(3)]
+    assert api('POST', '/users/bulk', users) == (400, {'status': 'error',
+                                                       'message': 'At most 2 items can be created per request'})
+
+
+def test_bulk_create_order_details_computes_sub_totals(api, db):
+    from db.models import Order
+    from db.session import SessionFactory
+
+    user_id = api('POST', '/users', {'username': 'buyer', 'email': 'buyer@example.com', 'password': 'x'})[1]['id']
+    product_ids = api('POST', '/products/bulk', [{'name': 'Mug', 'price': 4.5, 'stock': 10},
+                                                 {'name': 'Cap', 'price': 12.0, 'stock': 10}])[1]['ids']
+    session = SessionFactory()
+    order = Order(user_id=user_id, total=0)
+    session.add(order)
+    session.commit()
+    session.close()
+
+    status, body = api('POST', '/orderdetails/bulk', [
+        {'order_id': order.id, 'product_id': product_ids[0], 'quantity': 2},
+        {'order_id': order.id, 'product_id': product_ids[1], 'quantity': 1},
+    ])
+
+    assert status == 201
+    assert [api('GET', f'/orderdetails/{detail_id}')[1]['sub_total'] for detail_id in body['ids']] == [9.0, 12.0]
+    status, body = api('POST', '/orderdetails/bulk', [
+        {'order_id': order.id, 'product_id': product_ids[0], 'quantity': 1},
+        {'order_id': order.id, 'product_id': 999, 'quantity': 1},
+        {'order_id': 998, 'product_id': 999, 'quantity': 0},
+        {'order_id': 998, 'product_id': 999, 'quantity': 1},
+    ])
+    assert status == 400
+    assert body['errors'] == [{'index': 1, 'error': 'product 999 not found'},
+                              {'index': 2, 'error': 'quantity must be a positive integer'},
+                              {'index': 3, 'error': 'order 998 not found; product 999 not found'}]
+
+
+def test_list_pages_follow_cursor(api):
+    api('POST', '/products/bulk', [{'name': f'Shirt {n}', 'price': 10.0, 'stock': n % 2} for n in range(7)])
+
+    names = []
+    cursor = ''
+    while cursor is not None:
+        status, body = api('GET', f'/products?limit=3&cursor={cursor}')
+        assert status == 200
+        assert len(body['items']) <= 3
+        names.extend(item['name'] for item in body['items'])
+        cursor = body['next_cursor']
+
+    assert names == [f'Shirt {n}' for n in range(7)]
+
+
+def test_list_by_created_at_with_filter(api):
+    api('POST', '/products/bulk', [{'name': f'Shirt {n}', 'price': 10.0, 'stock': n % 2} for n in range(7)])
+
+    status, first = api('GET', '/products?order_by=created_at&in_stock=true&limit=2')
+    _, second = api('GET', f"/products?order_by=created_at&in_stock=true&limit=2&cursor={first['next_cursor']}")
+
+    assert status == 200
+    assert [item['name'] for item in first['items'] + second['items']] == ['Shirt 1', 'Shirt 3', 'Shirt 5']
+    assert second['next_cursor'] is None
+
+
+def test_list_page_size_is_capped(api, monkeypatch):
+    monkeypatch.setattr('settings.PAGE_SIZE_MAX', 2)
+    api('POST', '/users/bulk', [{'username': f'u{n}', 'email': f'u{n}@example.com', 'password': 'x'} for n in range(3)])
+
+    _, body = api('GET', '/users?limit=100')
+
+    assert len(body['items']) == 2
+    assert body['next_cursor'] is not None
+
+
+def test_list_rejects_bad_arguments(api):
+    assert api('GET', '/orders?limit=abc')[0] == 400
+    assert api('GET', '/orders?cursor=not-a-cursor')[0] == 400
+    assert api('GET', '/orders?user_id=me')[0] == 400
+    assert api('GET', '/orders?order_by=total')[0] == 400
+
+
+def test_expanded_order_loads_in_fixed_number_of_queries(api, db):
+    from sqlalchemy import event
+
+    user_id = api('POST', '/users', {'username': 'buyer', 'email': 'buyer@example.com', 'password': 'x'})[1]['id']
+    product_ids = api('POST', '/products/bulk', [{'name': f'Item {n}', 'price': 2.0, 'stock': 10} for n in range(5)])[1]['ids']
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 20.0})[1]['id']
+    api('POST', '/orderdetails/bulk', [{'order_id': order_id, 'product_id': product_id, 'quantity': 2}
+                                       for product_id in product_ids])
+
+    statements = []
+    event.listen(db, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    status, body = api('GET', f'/orders/{order_id}?expand=order_details,order_details.product')
+
+    assert status == 200
+    assert [detail['product']['name'] for detail in body['order_details']] == [f'Item {n}' for n in range(5)]
+    assert len(statements) == 3
+
+
+def test_expand_rejects_unknown_relation(api):
+    assert api('GET', '/orders/1?expand=user')[0] == 400
+
+
+def test_request_session_is_released(api):
+    from db.session import Session
+
+    api('POST', '/products', {'name': 'Mug', 'price': 4.5, 'stock': 10})
+
+    assert not Session.registry.has()
+
+
+def test_failed_request_rolls_back(api, monkeypatch, caplog):
+    def broken(product):
+        raise RuntimeError('serializer failed')
+
+    monkeypatch.setattr('api.product_routes.serialize_product', broken)
+    status, body = api('POST', '/products', {'name': 'Mug', 'price': 4.5, 'stock': 10})
+    monkeypatch.undo()
+
+    assert (status, body) == (500, {'error': 'Internal server error'})
+    assert 'serializer failed' in caplog.text
+    assert api('GET', '/products')[1]['items'] == []
+
+
+def test_cache_is_invalidated_after_commit(api):
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 4.5, 'stock': 10})[1]['id']
+    api('GET', f'/products/{product_id}')
+
+    api('PUT', f'/products/{product_id}', {'price': 5.0})
+
+    assert api('GET', f'/products/{product_id}')[1]['price'] == 5.0
+
+
+def _checkout_fixture(api, stock):
+    user_id = api('POST', '/users', {'username': 'buyer', 'email': 'buyer@example.com', 'password': 'x'})[1]['id']
+    product_ids = api('POST', '/products/bulk', [{'name': 'Mug', 'price': 4.5, 'stock': stock},
+                                                 {'name': 'Cap', 'price': 12.0, 'stock': stock}])[1]['ids']
+    return user_id, product_ids
+
+
+def test_deleting_an_order_deletes_its_details(api):
+    user_id, (mug_id, cap_id) = _checkout_fixture(api, stock=5)
+    order = api('POST', '/orders/checkout', {'user_id': user_id, 'items': [
+        {'product_id': mug_id, 'quantity': 1}, {'product_id': cap_id, 'quantity': 1}]})[1]
+
+    assert api('DELETE', f"/orders/{order['id']}") == (200, {'message': 'Order deleted successfully'})
+    assert api('GET', f"/orders/{order['id']}")[0] == 404
+    assert api('GET', f"/orderdetails?order_id={order['id']}")[1]['items'] == []
+
+
+def test_referenced_users_and_products_are_not_deleted(api):
+    user_id, (mug_id, cap_id) = _checkout_fixture(api, stock=5)
+    order = api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': mug_id, 'quantity': 1}]})[1]
+
+    status, body = api('DELETE', f'/users/{user_id}')
+    assert status == 409
+    assert body['message'] == f'User with ID {user_id} has orders and cannot be deleted'
+    assert api('DELETE', f'/products/{mug_id}') == (409, {'error': 'Product has been ordered and cannot be deleted'})
+    assert api('GET', f'/users/{user_id}')[0] == 200
+    assert api('GET', f'/products/{mug_id}')[0] == 200
+    # Never ordered
+    assert api('DELETE', f'/products/{cap_id}')[0] == 200
+
+    api('DELETE', f"/orders/{order['id']}")
+    assert api('DELETE', f'/users/{user_id}')[0] == 200
+    assert api('DELETE', f'/products/{mug_id}')[0] == 200
+
+
+def test_checkout_prices_order_and_takes_stock(api):
+    user_id, (mug_id, cap_id) = _checkout_fixture(api, stock=5)
+    api('GET', f'/products/{mug_id}')  # cache the product with its old stock
+
+    status, order = api('POST', '/orders/checkout', {'user_id': user_id, 'items': [
+        {'product_id': mug_id, 'quantity': 2},
+        {'product_id': cap_id, 'quantity': 1},
+        {'product_id': mug_id, 'quantity': 1},
+    ]})
+
+    assert status == 201
+    assert order['total'] == 25.5
+    assert [(line['product_id'], line['quantity'], line['sub_total']) for line in order['order_details']] == [
+        (mug_id, 3, 13.5), (cap_id, 1, 12.0)]
+    assert api('GET', f'/products/{mug_id}')[1]['stock'] == 2
+    assert api('GET', f"/orders/{order['id']}?expand=order_details")[1]['order_details'][0]['quantity'] == 3
+
+
+def test_checkout_without_enough_stock_changes_nothing(api):
+    user_id, (mug_id, cap_id) = _checkout_fixture(api, stock=1)
+
+    status, body = api('POST', '/orders/checkout', {'user_id': user_id, 'items': [
+        {'product_id': mug_id, 'quantity': 1},
+        {'product_id': cap_id, 'quantity': 2},
+    ]})
+
+    assert status == 409
+    assert body['error'] == f'Not enough stock for product {cap_id}'
+    assert api('GET', f'/products/{mug_id}')[1]['stock'] == 1
+    assert api('GET', '/orders')[1]['items'] == []
+
+
+def test_checkout_rejects_bad_input(api):
+    user_id, (mug_id, _) = _checkout_fixture(api, stock=1)
+
+    assert api('POST', '/orders/checkout', {'user_id': user_id, 'items': []})[0] == 400
+    assert api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': mug_id, 'quantity': 0}]})[0] == 400
+    assert api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': [mug_id], 'quantity': 1}]}) == (
+        400, {'error': 'Item 0 has an invalid product_id'})
+    assert api('POST', '/orders/checkout', {'user_id': {'id': user_id}, 'items': [{'product_id': mug_id, 'quantity': 1}]}) == (
+        400, {'error': 'user_id must be an integer'})
+    assert api('POST', '/orders/checkout', {'user_id': user_id, 'items': [{'product_id': 999, 'quantity': 1}]})[0] == 404
+    assert api('POST', '/orders/checkout', {'user_id': 999, 'items': [{'product_id': mug_id, 'quantity': 1}]})[0] == 404
+
+
+def test_conditional_get_answers_not_modified(api, db):
+    from sqlalchemy import event
+
+    user_id = api('POST', '/users', {'username': 'buyer', 'email': 'buyer@example.com', 'password': 'x'})[1]['id']
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 5.0})[1]['id']
+    response = handle(Request('GET', f'/orders/{order_id}', {}))
+    etag = dict(response.headers)['ETag']
+    last_modified = dict(response.headers)['Last-Modified']
+
+    statements = []
+    event.listen(db, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    response = handle(Request('GET', f'/orders/{order_id}', {'If-None-Match': etag}))
+
+    assert response.status == 304
+    assert response.body == b''
+    assert dict(response.headers)['ETag'] == etag
+    assert len(statements) == 1 and 'orders.total' not in statements[0]
+
+    response = handle(Request('GET', f'/orders/{order_id}', {'If-Modified-Since': last_modified}))
+    assert response.status == 304
+
+
+def _order_detail(api):
+    user_id = api('POST', '/users', {'username': 'buyer', 'email': 'buyer@example.com', 'password': 'x'})[1]['id']
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 4.5, 'stock': 10})[1]['id']
+    order_id = api('POST', '/orders', {'user_id': user_id, 'total': 4.5})[1]['id']
+    return api('POST', '/orderdetails', {'order_id': order_id, 'product_id': product_id, 'quantity': 1})[1]['id']
+
+
+def test_conditional_get_on_order_details(api):
+    detail_id = _order_detail(api)
+    response = handle(Request('GET', f'/orderdetails/{detail_id}', {}))
+    etag = dict(response.headers)['ETag']
+    last_modified = dict(response.headers)['Last-Modified']
+
+    assert handle(Request('GET', f'/orderdetails/{detail_id}', {'If-None-Match': etag})).status == 304
+    assert handle(Request('GET', f'/orderdetails/{detail_id}', {'If-Modified-Since': last_modified})).status == 304
+
+
+def test_conditional_get_on_order_detail_from_before_updated_at(api, db):
+    from sqlalchemy import text
+
+    detail_id = _order_detail(api)
+    with db.begin() as connection:
+        connection.execute(text('UPDATE order_details SET updated_at = NULL'))
+
+    # No timestamp to go by: an ETag from the version alone and no Last-Modified
+    response = handle(Request('GET', f'/orderdetails/{detail_id}', {}))
+    assert response.status == 200
+    assert dict(response.headers)['ETag'] == 'W/"1"'
+    assert 'Last-Modified' not in dict(response.headers)
+
+    assert handle(Request('GET', f'/orderdetails/{detail_id}', {'If-None-Match': 'W/"1"'})).status == 304
+    response = handle(Request('GET', f'/orderdetails/{detail_id}', {'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'}))
+    assert response.status == 200
+
+
+def test_update_changes_etag(api):
+    product_id = api('POST', '/products', {'name': 'Mug', 'price': 4.5, 'stock': 10})[1]['id']
+    etag = dict(handle(Request('GET', f'/products/{product_id}', {})).headers)['ETag']
+
+    api('PUT', f'/products/{product_id}', {'price': 5.0})
+    response = handle(Request('GET', f'/products/{product_id}', {'If-None-Match': etag}))
+
+    assert response.status == 200
+    assert json.loads(response.body)['version'] == 2
+    assert dict(response.headers)['ETag'] != etag
+
+
+def test_long_listing_is_streamed_and_gzipped(api, monkeypatch):
+    import gzip
+    import settings
+
+    monkeypatch.setattr(settings, 'STREAM_BATCH_ITEMS', 2)
+    api('POST', '/products/bulk', [{'name': f'Shirt {n}', 'price': 10.0, 'stock': n} for n in range(5)])
+
+    response = handle(Request('GET', '/products?limit=5', {'Accept-Encoding': 'br;q=1.0, gzip;q=0.5'}))
+
+    assert not isinstance(response.body, bytes)
+    assert ('Content-Encoding', 'gzip') in response.headers
+    body = json.loads(gzip.decompress(b''.join(response.body)))
+    assert [item['name'] for item in body['items']] == [f'Shirt {n}' for n in range(5)]
+    assert body['next_cursor'] is None
+
+
+def test_small_or_refused_responses_are_not_compressed(api):
+    small = handle(Request('GET', '/products/1', {'Accept-Encoding': 'gzip'}))
+    assert json.loads(small.body) == {'error': 'Product not found'}
+    assert ('Content-Encoding', 'gzip') not in small.headers
+
+    api('POST', '/products/bulk', [{'name': f'Shirt {n}', 'price': 10.0, 'stock': n} for n in range(50)])
+    refused = handle(Request('GET', '/products', {'Accept-Encoding': 'gzip;q=0, identity'}))
+    assert ('Content-Encoding', 'gzip') not in refused.headers
+    assert ('Vary', 'Accept-Encoding') in refused.headers
+    assert len(json.loads(refused.body)['items']) == 50
+
+
+def test_search_ranks_matches_and_follows_cursor(api):
+    api('POST', '/products/bulk', [
+        {'name': 'Café mug', 'description': 'Holds coffee', 'price': 8.0, 'stock': 3},
+        {'name': 'Shirt', 'description': 'Goes with a cafe mug', 'price': 20.0, 'stock': 0},
+        {'name': 'Cafe poster', 'description': 'Wall art', 'price': 12.0, 'stock': 5},
+        {'name': 'Tote bag', 'description': 'Canvas', 'price': 15.0, 'stock': 5},
+    ])
+
+    status, body = api('GET', '/products/search?q=cafe+mu')
+    assert status == 200
+    # Both words in the name outrank both words in the description
+    assert [item['name'] for item in body['items']] == ['Café mug', 'Shirt']
+
+    status, first = api('GET', '/products/search?q=caf&limit=2')
+    assert len(first['items']) == 2
+    status, second = api('GET', f"/products/search?q=caf&limit=2&cursor={first['next_cursor']}")
+    assert len(second['items']) == 1 and second['next_cursor'] is None
+    names = {item['name'] for item in first['items'] + second['items']}
+    assert names == {'Café mug', 'Shirt', 'Cafe poster'}
+
+    status, body = api('GET', '/products/search?q=cafe&min_price=10&in_stock=true')
+    assert [item['name'] for item in body['items']] == ['Cafe poster']
+
+
+def test_search_index_follows_writes(api):
+    product_id = api('POST', '/products', {'name': 'Red scarf', 'price': 9.0, 'stock': 1})[1]['id']
+    assert len(api('GET', '/products/search?q=scarf')[1]['items']) == 1
+
+    api('PUT', f'/products/{product_id}', {'name': 'Red hat'})
+    assert api('GET', '/products/search?q=scarf')[1]['items'] == []
+    assert len(api('GET', '/products/search?q=hat')[1]['items']) == 1
+
+    api('DELETE', f'/products/{product_id}')
+    assert api('GET', '/products/search?q=hat')[1]['items'] == []
+
+
+def test_search_needs_words(api):
+    assert api('GET', '/products/search')[0] == 400
+    assert api('GET', '/products/search?q=%22-*')[0] == 400
+    assert api('GET', '/products/search?q=NEAR(a+b)')[0] == 200
@@ -0,0 +1,72 @@
+import pytest
+
+from api.routes import router
+from web.routing import Router, NotFound, MethodNotAllowed
+
+
+def _handler(name):
+    def handler(request, **params):
+        return name, params
+    return handler
+
+
+@pytest.fixture
+def table():
+    table = Router()
+    table.add('GET', '/products/{product_id:int}', _handler('get_product'))
+    table.add('PUT', '/products/{product_id:int}', _handler('update_product'))
+    table.add('POST', '/products', _handler('create_product'))
+    table.add('POST', '/products/bulk', _handler('bulk_create_products'))
+    table.add('GET', '/tags/{tag}', _handler('get_tag'))
+    return table.compile()
+
+
+def test_static_route(table):
+    handler, params = table.match('POST', '/products')
+    assert handler(None, **params) == ('create_product', {})
+
+
+def test_typed_parameter_is_converted(table):
+    handler, params = table.match('GET', '/products/42')
+    assert params == {'product_id': 42}
+    assert handler(None, **params)[0] == 'get_product'
+
+
+def test_untyped_parameter_is_a_string(table):
+    assert table.match('GET', '/tags/summer')[1] == {'tag': 'summer'}
+
+
+def test_literal_segment_wins_over_parameter(table):
+    handler, _ = table.match('POST', '/products/bulk')
+    assert handler(None)[0] == 'bulk_create_products'
+
+
+def test_parameter_type_mismatch_is_not_found(table):
+    with pytest.raises(NotFound):
+        table.match('GET', '/products/abc')
+
+
+def test_unknown_path_is_not_found(table):
+    with pytest.raises(NotFound):
+        table.match('GET', '/customers/1')
+
+
+def test_wrong_method_lists_allowed_methods(table):
+    with pytest.raises(MethodNotAllowed) as excinfo:
+        table.match('DELETE', '/products/1')
+    assert excinfo.value.allowed == ['GET', 'PUT']
+
+
+def test_duplicate_route_is_rejected():
+    table = Router()
+    table.add('GET', '/users/{user_id:int}', _handler('a'))
+    table.add('GET', '/users/{user_id:int}', _handler('b'))
+    with pytest.raises(ValueError):
+        table.compile()
+
+
+@pytest.mark.parametrize('resource', ['users', 'products', 'orders', 'orderdetails'])
+def test_every_resource_is_routed(resource):
+    router.match('POST', f'/{resource}')
+    for method in ('GET', 'PUT', 'DELETE'):
+        router.match(method, f'/{resource}/1')
@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from api.serializers import serializers
+from db.models import Product, User
+from db.session import Session, request_scope
+
+
+def test_core_row_and_orm_object_serialize_alike(db):
+    with request_scope():
+        session = Session()
+        product = Product(name='Mug', description='', price=4.5, stock=3,
+                          created_at=datetime(2024, 5, 1, 12, 30), updated_at=datetime(2024, 5, 2, 8, 0))
+        session.add(product)
+        session.flush()
+
+        from_orm = serializers[Product](product)
+        from_row = serializers[Product].fetch_by_id(session, product.id)
+
+    assert from_orm == from_row == {
+        'id': product.id, 'name': 'Mug', 'description': '', 'price': 4.5, 'stock': 3,
+        'created_at': '2024-05-01T12:30:00', 'updated_at': '2024-05-02T08:00:00', 'version': 1,
+    }
+
+
+def test_password_is_never_serialized(db):
+    user = User(id=1, username='u', email='u@example.com', password='secret', created_at=datetime(2024, 1, 1))
+
+    assert 'password' not in serializers[User](user)
+
+
+def test_missing_row_serializes_to_none(db):
+    with request_scope():
+        assert serializers[Product].fetch_by_id(Session(), 42) is None
@@ -0,0 +1,107 @@
+"""Admission control: under overload, turn requests away at once instead of serving them late.
+
+The dispatcher asks admit() before running a route. A request is shed, answered right away
+with a 503 and Retry-After, when:
+
+- it waited for a worker for longer than ADMISSION_MAX_QUEUE_SECONDS. Its client has likely
+  given up already, and serving it would only delay the requests queued behind it.
+- ADMISSION_MAX_IN_FLIGHT requests are already running.
+- it is a write (any method but GET) and ADMISSION_WRITE_LIMIT writes are already running.
+  Writes queue on the database lock when they pile up, and this keeps workers free for reads.
+- its route has a limit in ADMISSION_ROUTE_LIMITS and that many requests to it are running.
+
+No request waits for a slot. Under overload, a refusal the client can retry keeps latency
+bounded for the requests that are admitted. GET /metrics is always admitted, so an overloaded
+server can still be observed.
+"""
+import threading
+import time
+import settings
+
+# Routes never shed, by (method, pattern)
+UNLIMITED_ROUTES = frozenset({('GET', '/metrics')})
+
+
+def parse_route_limits(text):
+    """Parse 'METHOD pattern=limit, ...' into {(method, pattern): limit}."""
+    limits = {}
+    for entry in text.split(','):
+        if not entry.strip():
+            continue
+        route, _, limit = entry.rpartition('=')
+        method, _, pattern = route.strip().partition(' ')
+        if not method or not pattern or not limit.strip().isdigit():
+            raise ValueError(f"Malformed route limit {entry.strip()!r}, expected 'METHOD pattern=limit'")
+        limits[method.upper(), pattern.strip()] = int(limit)
+    return limits
+
+
+def default_write_limit(workers):
+    # Three quarters of the workers, the rest kept for reads, but always room for one write
+    return max(workers * 3 // 4, 1)
+
+
+class AdmissionControl:
+    """Counts the requests running, overall, for writes and per route, and refuses those over a limit."""
+
+    def __init__(self, max_in_flight=settings.ADMISSION_MAX_IN_FLIGHT, write_limit=settings.ADMISSION_WRITE_LIMIT,
+                 route_limits=None, max_queue_seconds=settings.ADMISSION_MAX_QUEUE_SECONDS):
+        self.max_in_flight = max_in_flight
+        # None follows the number of workers, see size_for()
+        self._configured_write_limit = write_limit
+        self.write_limit = default_write_limit(settings.WORKERS) if write_limit is None else write_limit
+        self.route_limits = parse_route_limits(settings.ADMISSION_ROUTE_LIMITS) if route_limits is None \
+            else route_limits
+        self.max_queue_seconds = max_queue_seconds
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.writes = 0
+        self._routes = {}
+
+    def size_for(self, workers):
+        """Fit the limits to the worker threads the server actually runs, unless they were set explicitly."""
+        if self._configured_write_limit is None:
+            self.write_limit = default_write_limit(workers)
+
+    def admit(self, method, pattern, received=None):
+        """Take a slot for a request, returning None, or the reason it is shed without taking one.
+
+        received is the time.monotonic() at which the server got the request, if it knows.
+        Every admitted request must be released().
+        """
+        key = (method, pattern)
+        if key in UNLIMITED_ROUTES:
+            return None
+        if received is not None and self.max_queue_seconds and time.monotonic() - received > self.max_queue_seconds:
+            return 'queue_timeout'
+
+        write = method != 'GET'
+        route_limit = self.route_limits.get(key)
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                return 'in_flight'
+            if write and self.write_limit and self.writes >= self.write_limit:
+                return 'writes'
+            if route_limit is not None and self._routes.get(key, 0) >= route_limit:
+                return 'route'
+
+            self.in_flight += 1
+            if write:
+                self.writes += 1
+            if route_limit is not None:
+                self._routes[key] = self._routes.get(key, 0) + 1
+        return None
+
+    def release(self, method, pattern):
+        key = (method, pattern)
+        if key in UNLIMITED_ROUTES:
+            return
+        with self._lock:
+            self.in_flight -= 1
+            if method != 'GET':
+                self.writes -= 1
+            if key in self._routes:
+                self._routes[key] -= 1
+
+
+admission = AdmissionControl()
@@ -0,0 +1,219 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPMessage
+import time
+import settings
+from web.admission import admission
+from web.app import Request, handle, json_response
+from web.encoding import chunked
+from web.metrics import metrics
+
+# Largest request line plus headers accepted from a client
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class AsyncHTTPServer:
+    """HTTP/1.1 front end that holds connections on an asyncio event loop.
+
+    Parsing and socket I/O stay on the loop, so an idle keep-alive connection costs a few
+    kilobytes instead of a thread. Route functions are synchronous SQLAlchemy code and run on
+    a dedicated executor; at most workers + queue_size requests are in flight at once, and
+    anything beyond that is answered with a 503 straight from the loop.
+    """
+
+    def __init__(self, host, port, workers=settings.WORKERS, queue_size=settings.QUEUE_SIZE,
+                 keepalive_timeout=settings.KEEPALIVE_TIMEOUT, sock=None):
+        self.host = host
+        self.port = port
+        # An already bound listening socket to serve instead of host and port
+        self.sock = sock
+        self.keepalive_timeout = keepalive_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix='http-worker')
+        admission.size_for(max(workers, 1))
+        self._capacity = max(workers, 1) + queue_size
+        self._in_flight = 0
+        self._server = None
+        # The task serving each open connection, by its writer
+        self._connections = {}
+        # Connections owing a response: from accepting them to answering their first request, and
+        # later from reading a request's head to writing its response
+        self._busy = set()
+        self._closing = False
+
+    async def start(self):
+        if self.sock is not None:
+            self._server = await asyncio.start_server(self._serve_connection, sock=self.sock,
+                                                      limit=MAX_HEADER_BYTES)
+        else:
+            self._server = await asyncio.start_server(self._serve_connection, self.host, self.port,
+                                                      limit=MAX_HEADER_BYTES, backlog=self._capacity)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self, timeout=settings.SHUTDOWN_TIMEOUT):
+        """Stop accepting connections, let requests in flight finish, then drop the idle connections."""
+        self._closing = True
+        if self._server is not None:
+            # Stop accepting first. Connections accepted already take a few loop turns to reach
+            # _serve_connection, and closing the server before then drops them.
+            loop = asyncio.get_running_loop()
+            for sock in self._server.sockets:
+                loop.remove_reader(sock.fileno())
+            await asyncio.sleep(0.05)
+            self._server.close()
+            await self._server.wait_closed()
+
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self._busy and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.05)
+        # Idle keep-alive connections are still waiting for a request; cancelled and awaited here,
+        # they end quietly instead of being torn down by asyncio.run() after the loop stops
+        tasks = list(self._connections.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    async def _serve_connection(self, reader, writer):
+        self._connections[writer] = asyncio.current_task()
+        # Its client may have sent the request already; close() must not drop it unanswered
+        self._busy.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._write(writer, _error(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE), close=True)
+                    return
+
+                self._busy.add(writer)
+                parsed = _parse_head(head)
+                if parsed is None:
+                    await self._write(writer, _error(HTTPStatus.BAD_REQUEST), close=True)
+                    return
+                method, target, version, headers = parsed
+
+                if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+                    await self._write(writer, _error(HTTPStatus.LENGTH_REQUIRED), close=True)
+                    return
+                try:
+                    content_length = int(headers.get('Content-Length', 0))
+                    body = await reader.readexactly(content_length) if content_length else b''
+                except ValueError:
+                    await self._write(writer, _error(HTTPStatus.BAD_REQUEST), close=True)
+                    return
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+
+                connection = headers.get('Connection', '').lower()
+                close = (connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+                         or self._closing)
+
+                response = await self._dispatch(Request(method, target, headers, body, time.monotonic()))
+                if not isinstance(response.body, bytes) and version != 'HTTP/1.1':
+                    # HTTP/1.0 has no chunked encoding; the end of a streamed body is the end of the connection
+                    close = True
+                if not await self._write(writer, response, close or self._closing):
+                    return
+                if close or self._closing:
+                    return
+                self._busy.discard(writer)
+        except ConnectionError:
+            pass
+        finally:
+            self._busy.discard(writer)
+            self._connections.pop(writer, None)
+            writer.close()
+
+    async def _dispatch(self, request):
+        if self._in_flight >= self._capacity:
+            metrics.count_shed('unmatched', 'queue_full')
+            return json_response(HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'Server is too busy'},
+                                 [('Retry-After', '1')])
+
+        self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, handle, request)
+        finally:
+            self._in_flight -= 1
+
+    async def _write(self, writer, response, close):
+        """Send a response, returning False if a streamed body failed part way through."""
+        status = HTTPStatus(response.status)
+        lines = [f'HTTP/1.1 {status.value} {status.phrase}',
+                 f'Date: {formatdate(usegmt=True)}']
+        lines.extend(f'{name}: {value}' for name, value in response.headers)
+        streamed = not isinstance(response.body, bytes)
+        if streamed:
+            if not close:
+                lines.append('Transfer-Encoding: chunked')
+        elif response.status not in (204, 304):
+            lines.append(f'Content-Length: {len(response.body)}')
+        if close:
+            lines.append('Connection: close')
+        head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        if not streamed:
+            writer.write(head + response.body)
+            await writer.drain()
+            return True
+
+        writer.write(head)
+        chunks = iter(response.body if close else chunked(response.body))
+        loop = asyncio.get_running_loop()
+        while True:
+            # Producing a chunk encodes, compresses and may query the database; keep that off the loop
+            try:
+                chunk = await loop.run_in_executor(self.executor, next, chunks, None)
+            except Exception:
+                return False
+            if chunk is None:
+                return True
+            writer.write(chunk)
+            await writer.drain()
+
+
+def _parse_head(head):
+    """Split the request line and headers, or return None when they are malformed."""
+    request_line, _, header_block = head.partition(b'\r\n')
+    try:
+        method, target, version = request_line.decode('latin-1').split()
+    except ValueError:
+        return None
+    if not version.startswith('HTTP/1.'):
+        return None
+
+    headers = BytesParser(_class=HTTPMessage).parsebytes(header_block)
+    return method, target, version, headers
+
+
+def _error(status):
+    return json_response(status, {'error': status.phrase})
+
+
+def run(host=settings.HOST, port=settings.PORT, workers=settings.WORKERS, queue_size=settings.QUEUE_SIZE):
+    """Serve the API from an event loop until interrupted."""
+    server = AsyncHTTPServer(host, port, workers, queue_size)
+
+    async def main():
+        await server.start()
+        print(f"Server started at http://{host}:{server.port} (asyncio)")
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,161 @@
+from collections.abc import Iterator
+from urllib.parse import urlparse, parse_qs
+import json
+import logging
+from sqlalchemy.orm.exc import StaleDataError
+import settings
+from api.passwords import PasswordHasherBusy
+from api.routes import router
+from db.session import begin_request, end_request
+from web.admission import admission
+from web.encoding import gzip_response
+from web.metrics import metrics, start_request, finish_request
+from web import profiling
+from web.routing import NotFound, MethodNotAllowed
+
+try:
+    # Optional accelerated encoder; it writes UTF-8 bytes directly instead of building a str first
+    import orjson
+except ImportError:
+    orjson = None
+
+error_log = logging.getLogger('errors')
+
+
+class Request:
+    """An HTTP request as seen by the application, whichever server engine received it."""
+
+    __slots__ = ('method', 'path', 'query', 'headers', 'body', 'received')
+
+    def __init__(self, method, target, headers, body=b'', received=None):
+        parsed_path = urlparse(target)
+
+        self.method = method
+        self.path = parsed_path.path
+        self.query = parse_qs(parsed_path.query)
+        self.headers = headers
+        self.body = body
+        # time.monotonic() when the server got the request, before it waited for a worker; None if unknown
+        self.received = received
+
+    def json(self):
+        return json.loads(self.body) if self.body else {}
+
+
+class Response:
+    """Status, extra headers and encoded body to be written back by the server engine.
+
+    body is either bytes, sent with a Content-Length, or an iterable of bytes chunks, sent with
+    chunked transfer encoding as it is produced.
+    """
+
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status, body=b'', headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or []
+
+
+def encode_json(content):
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(',', ':')).encode()
+
+
+def iter_json(content, batch_size=None):
+    """Encode content as JSON in pieces, batch_size items of each list at a time."""
+    batch_size = batch_size or settings.STREAM_BATCH_ITEMS
+    if isinstance(content, list):
+        yield b'['
+        for start in range(0, len(content), batch_size):
+            # Strip the brackets off each encoded batch and join the batches with commas
+            yield (b',' if start else b'') + encode_json(content[start:start + batch_size])[1:-1]
+        yield b']'
+    elif isinstance(content, dict):
+        yield b'{'
+        for position, (key, value) in enumerate(content.items()):
+            yield (b',' if position else b'') + encode_json(str(key)) + b':'
+            yield from iter_json(value, batch_size)
+        yield b'}'
+    else:
+        yield encode_json(content)
+
+
+def json_response(status, content, headers=None):
+    """Encode content as a JSON response; long lists are streamed rather than encoded in one piece."""
+    body = iter_json(content) if _is_long_listing(content) else encode_json(content)
+    return Response(status, body, [('Content-Type', 'application/json')] + (headers or []))
+
+
+def _is_long_listing(content):
+    values = content.values() if isinstance(content, dict) else (content,)
+    return any(isinstance(value, list) and len(value) > settings.STREAM_BATCH_ITEMS for value in values)
+
+
+def handle(request):
+    """Run a request through the route table and build its response, compressed if the client allows."""
+    started = start_request()
+    route, response = _dispatch(request)
+    seconds, statements = finish_request(request.method, router.patterns.get(route, 'unmatched'),
+                                         response.status, started)
+    profiling.log_if_slow(request.method, request.path, response.status, seconds, statements)
+    return gzip_response(response, request.headers.get('Accept-Encoding'))
+
+
+def _dispatch(request):
+    """Return the matched route, or None, and its response."""
+    try:
+        route, params = router.match(request.method, request.path)
+    except NotFound:
+        return None, json_response(404, {'error': 'Resource not found'})
+    except MethodNotAllowed as e:
+        return None, json_response(405, {'error': str(e)}, [('Allow', ', '.join(e.allowed))])
+
+    pattern = router.patterns[route]
+    reason = admission.admit(request.method, pattern, request.received)
+    if reason is not None:
+        metrics.count_shed(pattern, reason)
+        return route, json_response(503, {'error': 'Server is too busy, please retry'}, [('Retry-After', '1')])
+
+    try:
+        if profiling.should_profile(request, pattern):
+            return route, profiling.profile(request.method, pattern, _run, route, request, params)
+        return route, _run(route, request, params)
+    finally:
+        admission.release(request.method, pattern)
+
+
+def _run(route, request, params):
+    # The route works in the request's session; its changes are committed here, once,
+    # and only if it succeeded. GETs don't write, so their reads may go to a replica.
+    begin_request(read_only=request.method == 'GET')
+    try:
+        response_content, status, *headers = route(request, **params)
+        end_request(commit=status < 400)
+    except Exception as e:
+        end_request(commit=False)
+        return _error_response(e)
+
+    headers = headers[0] if headers else []
+    if status == 304:
+        return Response(status, b'', headers)
+    if isinstance(response_content, (bytes, Iterator)):
+        # Already encoded by the route, whole or as a stream of chunks, and it sets its own Content-Type
+        return Response(status, response_content, headers)
+    return json_response(status, response_content, headers)
+
+
+def _error_response(error):
+    if isinstance(error, json.JSONDecodeError):
+        return json_response(400, {'error': 'Request body is not valid JSON'})
+    if isinstance(error, KeyError):
+        return json_response(400, {'error': f'Missing required field {error}'})
+    if isinstance(error, PasswordHasherBusy):
+        return json_response(503, {'error': 'Too many passwords are being processed, please retry'},
+                             [('Retry-After', '1')])
+    if isinstance(error, StaleDataError):
+        return json_response(409, {'error': 'The resource was modified by another request, please retry'})
+    # The exception text can hold SQL statements and their parameters; it stays in the log
+    error_log.error('Unhandled error in route', exc_info=error)
+    return json_response(500, {'error': 'Internal server error'})
@@ -0,0 +1,75 @@
+"""Content and transfer codings applied to responses on their way out."""
+import zlib
+import settings
+
+
+def accepts_gzip(accept_encoding):
+    """Whether an Accept-Encoding header value allows a gzip-coded response."""
+    if not accept_encoding:
+        return False
+
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, _, parameters = part.partition(';')
+        quality = 1.0
+        parameters = parameters.replace(' ', '')
+        if parameters.startswith('q='):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+def gzip_response(response, accept_encoding):
+    """Compress the response body with gzip when the client accepts it and the body is worth it.
+
+    Bodies under GZIP_MIN_SIZE are left alone; for those the gzip framing and CPU time cost
+    more than the bytes saved. Streamed bodies are compressed chunk by chunk as they are
+    produced, so they are never held in memory whole.
+    """
+    if response.status in (204, 304):
+        return response
+
+    streamed = not isinstance(response.body, bytes)
+    if not streamed and len(response.body) < settings.GZIP_MIN_SIZE:
+        return response
+
+    # Shared caches must keep the compressed and plain variants apart
+    response.headers.append(('Vary', 'Accept-Encoding'))
+    if not accepts_gzip(accept_encoding):
+        return response
+
+    response.headers.append(('Content-Encoding', 'gzip'))
+    if streamed:
+        response.body = _gzip_stream(response.body)
+    else:
+        compressor = _gzip_compressor()
+        response.body = compressor.compress(response.body) + compressor.flush()
+    return response
+
+
+def chunked(chunks):
+    """Frame body chunks with the HTTP/1.1 chunked transfer coding, ending with the last-chunk marker."""
+    for chunk in chunks:
+        # A zero-length chunk would end the body early
+        if chunk:
+            yield b'%x\r\n%s\r\n' % (len(chunk), chunk)
+    yield b'0\r\n\r\n'
+
+
+def _gzip_stream(chunks):
+    compressor = _gzip_compressor()
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _gzip_compressor():
+    # wbits 31 writes a gzip header and trailer rather than a bare zlib stream
+    return zlib.compressobj(settings.GZIP_LEVEL, zlib.DEFLATED, 31)
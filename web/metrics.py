@@ -0,0 +1,206 @@
+"""Request and database metrics, exposed in the Prometheus text format at GET /metrics.
+
+The dispatcher times every request and labels it with its route pattern rather than the raw
+path, so the number of series stays fixed however many ids are requested. SQL statements
+are counted and timed through SQLAlchemy engine events and charged to the request running
+on the same thread. Recording a request takes one short lock and a few list increments,
+cheap enough to leave on all the time.
+"""
+from bisect import bisect_left
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds of the histogram buckets, in seconds and in statements per request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    """Histogram with fixed bucket bounds; counts are kept per bucket and summed up when rendered."""
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bound, plus the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+class Metrics:
+    """Request latencies by (method, route, status), SQL statements by route and other named timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.queries = {}
+        self.query_seconds = {}
+        # (route, reason) -> requests turned away unserved, see web/admission.py
+        self.shed = {}
+        # name -> description and {label items: Histogram}, for work timed apart from requests
+        self.timings = {}
+
+    def describe(self, name, description):
+        """Declare a timing histogram, in seconds, to be filled by observe()."""
+        with self._lock:
+            self.timings.setdefault(name, (description, {}))
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            histograms = self.timings[name][1]
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+
+    def record(self, method, route, status, seconds, queries, query_seconds):
+        with self._lock:
+            latency = self.latencies.get((method, route, status))
+            if latency is None:
+                latency = self.latencies[method, route, status] = Histogram(LATENCY_BUCKETS)
+            latency.observe(seconds)
+
+            statements = self.queries.get(route)
+            if statements is None:
+                statements = self.queries[route] = Histogram(QUERY_COUNT_BUCKETS)
+                self.query_seconds[route] = 0.0
+            statements.observe(queries)
+            self.query_seconds[route] += query_seconds
+
+    def count_shed(self, route, reason):
+        with self._lock:
+            self.shed[route, reason] = self.shed.get((route, reason), 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self.latencies.clear()
+            self.queries.clear()
+            self.query_seconds.clear()
+            self.shed.clear()
+            for _, histograms in self.timings.values():
+                histograms.clear()
+
+    def render(self, caches=None):
+        """The Prometheus text exposition of every metric, plus the stats of caches ({name: LRUCache})."""
+        with self._lock:
+            latencies = {key: (list(h.counts), h.sum) for key, h in self.latencies.items()}
+            queries = {key: (list(h.counts), h.sum) for key, h in self.queries.items()}
+            query_seconds = dict(self.query_seconds)
+            shed = dict(self.shed)
+            timings = {name: (description, {key: (list(h.counts), h.sum) for key, h in histograms.items()})
+                       for name, (description, histograms) in self.timings.items()}
+
+        lines = ['# HELP http_requests_total Requests handled, by route and status.',
+                 '# TYPE http_requests_total counter']
+        for (method, route, status), (counts, _) in sorted(latencies.items()):
+            lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {sum(counts)}')
+
+        lines += ['# HELP http_request_duration_seconds Time to run the route and build its response.',
+                  '# TYPE http_request_duration_seconds histogram']
+        for (method, route, status), (counts, total) in sorted(latencies.items()):
+            lines += _histogram_lines('http_request_duration_seconds', LATENCY_BUCKETS, counts, total,
+                                      method=method, route=route, status=status)
+
+        lines += ['# HELP db_queries_per_request SQL statements executed per request.',
+                  '# TYPE db_queries_per_request histogram']
+        for route, (counts, total) in sorted(queries.items()):
+            lines += _histogram_lines('db_queries_per_request', QUERY_COUNT_BUCKETS, counts, total, route=route)
+
+        lines += ['# HELP db_query_seconds_total Time spent executing SQL statements.',
+                  '# TYPE db_query_seconds_total counter']
+        for route, seconds in sorted(query_seconds.items()):
+            lines.append(f'db_query_seconds_total{_labels(route=route)} {seconds!r}')
+
+        lines += ['# HELP http_requests_shed_total Requests answered with a 503 without running, by route and reason.',
+                  '# TYPE http_requests_shed_total counter']
+        for (route, reason), count in sorted(shed.items()):
+            lines.append(f'http_requests_shed_total{_labels(route=route, reason=reason)} {count}')
+
+        for name, (description, histograms) in sorted(timings.items()):
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+            for key, (counts, total) in sorted(histograms.items()):
+                lines += _histogram_lines(name, LATENCY_BUCKETS, counts, total, **dict(key))
+
+        if caches:
+            stats = {name: cache.stats() for name, cache in caches.items()}
+            for stat, kind, description in (('hits', 'counter', 'Cache lookups answered from the cache.'),
+                                            ('misses', 'counter', 'Cache lookups that went to the database.'),
+                                            ('size', 'gauge', 'Entries held by the cache.')):
+                name = f'cache_{stat}_total' if kind == 'counter' else f'cache_{stat}'
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+                lines += [f'{name}{_labels(cache=cache)} {values[stat]}' for cache, values in sorted(stats.items())]
+
+        return ('\n'.join(lines) + '\n').encode()
+
+
+metrics = Metrics()
+
+# Statements executed so far by the request running on this thread
+_request = threading.local()
+
+
+def start_request():
+    """Start accounting for a request on the current thread and return its start time."""
+    _request.queries = 0
+    _request.query_seconds = 0.0
+    # (statement, seconds) of every query, kept only for the slow request log
+    _request.statements = [] if settings.SLOW_REQUEST_SECONDS else None
+    _request.active = True
+    return time.perf_counter()
+
+
+def finish_request(method, route, status, started):
+    """Record the request and return its duration and the statements it ran, if they were kept."""
+    _request.active = False
+    seconds = time.perf_counter() - started
+    metrics.record(method, route, int(status), seconds, _request.queries, _request.query_seconds)
+    return seconds, _request.statements or []
+
+
+# Registered on the Engine class, so engines created later by db.session.configure() are counted too
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_request, 'active', False) and context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None and getattr(_request, 'active', False):
+        elapsed = time.perf_counter() - started
+        _request.queries += 1
+        _request.query_seconds += elapsed
+        if _request.statements is not None:
+            _request.statements.append((statement, elapsed))
+
+
+def _histogram_lines(name, bounds, counts, total, **labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(bounds + ('+Inf',), counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+    lines.append(f'{name}_sum{_labels(**labels)} {total!r}')
+    lines.append(f'{name}_count{_labels(**labels)} {cumulative}')
+    return lines
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+from http.server import HTTPServer
+import settings
+from web.metrics import metrics
+
+# Sent as-is to connections that arrive while every worker is busy and the queue is full
+BUSY_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: application/json\r\n'
+    b'Content-Length: 31\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'\r\n'
+    b'{"error": "Server is too busy"}'
+)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """HTTPServer that hands accepted connections to a fixed pool of worker threads.
+
+    Connections wait in a bounded queue until a worker is free. Once the queue is full,
+    new connections get an immediate 503 instead of piling up in the listen backlog.
+    """
+
+    def __init__(self, server_address, handler_class, workers=16, queue_size=128, bind_and_activate=True,
+                 shutdown_timeout=settings.SHUTDOWN_TIMEOUT):
+        self.workers = workers
+        # Seconds server_close() gives the connections already accepted to finish
+        self.shutdown_timeout = shutdown_timeout
+        self.request_queue_size = max(queue_size, 5)
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        # When the connection being served on each worker thread was accepted
+        self._accepted = threading.local()
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+        for number in range(workers):
+            thread = threading.Thread(target=self._work, name=f'http-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def process_request(self, request, client_address):
+        """Queue the connection for a worker, or turn it away when the queue is full."""
+        try:
+            self._requests.put_nowait((request, client_address, time.monotonic()))
+        except queue.Full:
+            metrics.count_shed('unmatched', 'queue_full')
+            try:
+                request.sendall(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def _work(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+
+            request, client_address, self._accepted.at = item
+            try:
+                # Serves every request on the connection until the client closes it
+                # or it sits idle for longer than the handler's timeout
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def queued_since(self):
+        """When the connection served on this thread was accepted, for its first request; None for later ones.
+
+        Only the first request on a connection waits in the queue; later ones are read by the
+        worker already serving it.
+        """
+        accepted = getattr(self._accepted, 'at', None)
+        self._accepted.at = None
+        return accepted
+
+    def server_close(self):
+        super().server_close()
+
+        # Workers finish the connections queued ahead of their stop marker first
+        for _ in self._threads:
+            self._requests.put(None)
+        deadline = time.monotonic() + self.shutdown_timeout
+        for thread in self._threads:
+            thread.join(timeout=max(deadline - time.monotonic(), 0))
+        self._threads = []
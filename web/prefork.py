@@ -0,0 +1,255 @@
+"""Pre-fork supervisor: several worker processes serving one port, so requests use every core.
+
+Each worker is a complete server, running either engine. It gets its own GIL, its own database
+connection pools and its own caches. Every worker accepts from one listening socket inherited
+from the supervisor, which keeps it open for as long as it runs. A retired worker just stops
+accepting, and connections waiting in the backlog go to the workers still serving. Per-worker
+SO_REUSEPORT sockets would spread connections more evenly, but closing one resets every
+connection still queued on it.
+
+The supervisor only watches:
+
+- A worker that exits is replaced.
+- A worker that stops reporting its heartbeat for HEALTH_TIMEOUT seconds is killed and replaced.
+  It writes the heartbeat from its accept loop or event loop, so this catches a wedged process.
+  Slow requests on the threads engine don't stop it; they are bounded by the pool's queue.
+- SIGHUP restarts the workers without dropping traffic. A new set is started, and the old one
+  is told to drain once the new workers are serving.
+- SIGTERM or SIGINT drains every worker and exits.
+
+A worker whose supervisor has died, even by SIGKILL, notices on its next heartbeat and drains too.
+"""
+import asyncio
+from multiprocessing import RawValue
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import settings
+import db.session
+from web.admission import admission
+from web.aio import AsyncHTTPServer
+from web.pool import ThreadPoolHTTPServer
+
+# Seconds between the supervisor's checks
+TICK = 0.2
+
+
+class _Worker:
+    __slots__ = ('pid', 'heartbeat', 'started', 'stop_deadline')
+
+    def __init__(self, pid, heartbeat):
+        self.pid = pid
+        # time.monotonic() of the worker's last sign of life, in memory shared with it; 0 until it serves
+        self.heartbeat = heartbeat
+        self.started = time.monotonic()
+        # Set once the worker has been asked to stop
+        self.stop_deadline = None
+
+    @property
+    def ready(self):
+        return self.heartbeat.value > 0
+
+
+class Supervisor:
+    """Forks the worker processes and keeps them serving until told to stop."""
+
+    def __init__(self, handler_class, engine=settings.ENGINE, host=settings.HOST, port=settings.PORT,
+                 processes=settings.PROCESSES, workers=settings.WORKERS, queue_size=settings.QUEUE_SIZE,
+                 health_timeout=settings.HEALTH_TIMEOUT, shutdown_timeout=settings.SHUTDOWN_TIMEOUT):
+        self.handler_class = handler_class
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.processes = processes
+        self.workers = workers
+        self.queue_size = queue_size
+        self.health_timeout = health_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self._children = {}
+        self._listener = None
+        self._pid = None
+        self._stopping = False
+        self._restarting = False
+
+    def bind(self):
+        """Claim the port; with port 0 this picks the one every worker will share."""
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self.port = self._listener.getsockname()[1]
+        # One backlog in front of every worker
+        self._listener.listen(self.queue_size * self.processes)
+
+    def run(self):
+        if self._listener is None:
+            self.bind()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._restart)
+        self._pid = os.getpid()
+
+        # Connections opened by init_db() and the query plan check must not leak into the children
+        db.session.engine.dispose()
+        for _ in range(self.processes):
+            self._spawn()
+        print(f"Server started at http://{self.host}:{self.port} ({self.processes} processes, {self.engine})")
+
+        try:
+            while not self._stopping:
+                if self._restarting:
+                    self._restarting = False
+                    self._rolling_restart()
+                self._check()
+                time.sleep(TICK)
+        finally:
+            self._shutdown()
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _restart(self, signum, frame):
+        self._restarting = True
+
+    def _spawn(self):
+        heartbeat = RawValue('d', 0.0)
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._serve(heartbeat)
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                os._exit(code)
+
+        self._children[pid] = _Worker(pid, heartbeat)
+        return self._children[pid]
+
+    def _check(self):
+        """Replace workers that exited, kill hung ones and those past their shutdown deadline."""
+        while self._children:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            worker = self._children.pop(pid, None)
+            if worker is not None and worker.stop_deadline is None and not self._stopping:
+                self._spawn()
+
+        now = time.monotonic()
+        for worker in list(self._children.values()):
+            if worker.stop_deadline is not None:
+                hung = now > worker.stop_deadline
+            else:
+                last_seen = worker.heartbeat.value or worker.started
+                hung = now - last_seen > self.health_timeout
+            if hung:
+                _signal(worker.pid, signal.SIGKILL)
+
+    def _rolling_restart(self):
+        old = [worker for worker in self._children.values() if worker.stop_deadline is None]
+        new = [self._spawn() for _ in old]
+
+        deadline = time.monotonic() + self.health_timeout
+        while not all(worker.ready for worker in new) and time.monotonic() < deadline and not self._stopping:
+            self._check()
+            time.sleep(TICK)
+
+        for worker in old:
+            self._retire(worker)
+
+    def _retire(self, worker):
+        if worker.stop_deadline is None:
+            worker.stop_deadline = time.monotonic() + self.shutdown_timeout
+            _signal(worker.pid, signal.SIGTERM)
+
+    def _shutdown(self):
+        for worker in list(self._children.values()):
+            self._retire(worker)
+        while self._children:
+            self._check()
+            time.sleep(TICK)
+        self._listener.close()
+
+    # The methods below run in the worker processes
+
+    def _serve(self, heartbeat):
+        # The supervisor decides when workers stop; a Ctrl-C reaches the whole process group
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        db.session.after_fork()
+
+        # Every worker is woken for each new connection and only one accepts it. The others
+        # must get EAGAIN rather than block in accept(), where no heartbeat or shutdown reaches them.
+        sock = self._listener
+        sock.setblocking(False)
+
+        orphaned = False
+
+        def beat():
+            nonlocal orphaned
+            heartbeat.value = time.monotonic()
+            if os.getppid() != self._pid and not orphaned:
+                # The supervisor is gone and nothing would ever stop this worker; drain as on SIGTERM
+                orphaned = True
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        if self.engine == 'asyncio':
+            self._serve_asyncio(sock, beat)
+        else:
+            self._serve_threads(sock, beat)
+
+    def _serve_threads(self, sock, beat):
+        admission.size_for(self.workers)
+        httpd = _WorkerHTTPServer(sock, beat, self.handler_class, self.workers, self.queue_size, self.shutdown_timeout)
+        # shutdown() waits for serve_forever() to return, so it can't run on the thread serving
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+        try:
+            httpd.serve_forever()
+        finally:
+            httpd.server_close()
+
+    def _serve_asyncio(self, sock, beat):
+        server = AsyncHTTPServer(self.host, self.port, self.workers, self.queue_size, sock=sock)
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            stopping = asyncio.Event()
+            loop.add_signal_handler(signal.SIGTERM, stopping.set)
+            await server.start()
+            while not stopping.is_set():
+                beat()
+                try:
+                    await asyncio.wait_for(stopping.wait(), TICK)
+                except asyncio.TimeoutError:
+                    pass
+            await server.close(self.shutdown_timeout)
+
+        asyncio.run(main())
+
+
+class _WorkerHTTPServer(ThreadPoolHTTPServer):
+    """ThreadPoolHTTPServer on an existing listening socket, reporting a heartbeat from its accept loop."""
+
+    def __init__(self, sock, beat, handler_class, workers, queue_size, shutdown_timeout):
+        super().__init__(sock.getsockname(), handler_class, workers=workers, queue_size=queue_size,
+                         bind_and_activate=False, shutdown_timeout=shutdown_timeout)
+        self.socket.close()
+        self.socket = sock
+        self.server_name, self.server_port = sock.getsockname()[:2]
+        self._beat = beat
+
+    def service_actions(self):
+        # Called by serve_forever() at least every poll interval (0.5 s)
+        self._beat()
+
+
+def _signal(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        pass
@@ -0,0 +1,84 @@
+"""Opt-in cProfile sampling of requests and a log of slow requests with their SQL.
+
+A request is profiled when any of these holds:
+
+- a random draw falls under PROFILE_SAMPLE_RATE,
+- its route pattern is PROFILE_ROUTE,
+- it carries an X-Profile header equal to PROFILE_TOKEN.
+
+Profiles are merged per route and the running total is written to
+PROFILE_DIR/<method>_<route>.prof after each profiled request. Read it with
+`python -m pstats`. Only one request is profiled at a time; others that qualify
+meanwhile run unprofiled.
+"""
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import settings
+
+slow_request_log = logging.getLogger('slow_requests')
+
+# Running totals by (method, route pattern)
+_stats = {}
+_profiling = threading.Lock()
+
+
+def should_profile(request, route):
+    if settings.PROFILE_ROUTE and route == settings.PROFILE_ROUTE:
+        return True
+    if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return True
+    token = request.headers.get('X-Profile')
+    if not settings.PROFILE_TOKEN or not token:
+        return False
+    # compare_digest only takes ASCII strings; bytes cover whatever a client puts in the header
+    return hmac.compare_digest(token.encode('utf-8', 'surrogatepass'),
+                               settings.PROFILE_TOKEN.encode('utf-8', 'surrogatepass'))
+
+
+def profile(method, route, call, *args):
+    """Return call(*args), profiled and added to the route's stats file unless a profile is already running."""
+    if not _profiling.acquire(blocking=False):
+        return call(*args)
+    try:
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(call, *args)
+        finally:
+            _add_stats(method, route, profiler)
+    finally:
+        _profiling.release()
+
+
+def stats_path(method, route):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', f'{method} {route}').strip('_')
+    return os.path.join(settings.PROFILE_DIR, f'{name}.prof')
+
+
+def log_if_slow(method, path, status, seconds, statements):
+    """Log a request over SLOW_REQUEST_SECONDS with each SQL statement it ran and how long that took."""
+    if not settings.SLOW_REQUEST_SECONDS or seconds < settings.SLOW_REQUEST_SECONDS:
+        return
+    lines = [f'{method} {path} -> {int(status)} took {seconds * 1000:.1f} ms, {len(statements)} SQL statements']
+    lines.extend(f'  {elapsed * 1000:8.2f} ms  {" ".join(statement.split())}' for statement, elapsed in statements)
+    slow_request_log.warning('\n'.join(lines))
+
+
+def _add_stats(method, route, profiler):
+    path = stats_path(method, route)
+    stats = _stats.get((method, route))
+    if stats is not None:
+        stats.add(profiler)
+    elif os.path.exists(path):
+        # Carry on from the file left by an earlier run
+        stats = _stats[method, route] = pstats.Stats(path)
+        stats.add(profiler)
+    else:
+        os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+        stats = _stats[method, route] = pstats.Stats(profiler)
+    stats.dump_stats(path)
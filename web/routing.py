@@ -0,0 +1,150 @@
+import re
+
+# Converters for typed path parameters, e.g. /users/{user_id:int}
+CONVERTERS = {
+    'int': (re.compile(r'\d+').fullmatch, int),
+    'str': (re.compile(r'[^/]+').fullmatch, str),
+}
+
+_PARAMETER = re.compile(r'\{(\w+)(?::(\w+))?\}')
+
+
+class NotFound(Exception):
+    """No route matches the request path."""
+
+
+class MethodNotAllowed(Exception):
+    """A route matches the path, but not for the request method."""
+
+    def __init__(self, allowed):
+        super().__init__(f"Method not allowed, expected one of {', '.join(allowed)}")
+        self.allowed = allowed
+
+
+class _Node:
+    __slots__ = ('children', 'parameters', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        # (name, accepts, convert, node) for each typed parameter segment at this depth
+        self.parameters = []
+        # method -> handler for routes ending at this node
+        self.handlers = {}
+
+
+class Router:
+    """Route registry, compiled once into lookups that don't grow with the number of routes.
+
+    Paths without parameters resolve through a single dict lookup on (method, path). The rest
+    walk a tree of path segments, so matching costs one step per segment however many
+    resources are registered. Literal segments win over parameters, which lets
+    /products/bulk and /products/{product_id:int} live side by side.
+    """
+
+    def __init__(self):
+        self.routes = []
+        # handler -> the pattern it was registered under, a low-cardinality label for metrics
+        self.patterns = {}
+        self._static = {}
+        self._static_methods = {}
+        self._root = None
+
+    def add(self, method, pattern, handler):
+        self.routes.append((method.upper(), pattern, handler))
+        self.patterns[handler] = pattern
+        self._root = None
+
+    def route(self, method, pattern):
+        """Decorator form of add()."""
+        def register(handler):
+            self.add(method, pattern, handler)
+            return handler
+        return register
+
+    def compile(self):
+        self._static = {}
+        self._static_methods = {}
+        self._root = _Node()
+
+        for method, pattern, handler in self.routes:
+            if not _PARAMETER.search(pattern):
+                if (method, pattern) in self._static:
+                    raise ValueError(f'Duplicate route {method} {pattern}')
+                self._static[method, pattern] = handler
+                self._static_methods.setdefault(pattern, []).append(method)
+                continue
+
+            node = self._root
+            for segment in _segments(pattern):
+                parameter = _PARAMETER.fullmatch(segment)
+                if parameter is None:
+                    node = node.children.setdefault(segment, _Node())
+                    continue
+
+                name, type_name = parameter.group(1), parameter.group(2) or 'str'
+                if type_name not in CONVERTERS:
+                    raise ValueError(f'Unknown parameter type {type_name!r} in {pattern}')
+                accepts, convert = CONVERTERS[type_name]
+
+                for existing in node.parameters:
+                    if existing[0] == name and existing[1] is accepts:
+                        node = existing[3]
+                        break
+                else:
+                    child = _Node()
+                    node.parameters.append((name, accepts, convert, child))
+                    node = child
+
+            if method in node.handlers:
+                raise ValueError(f'Duplicate route {method} {pattern}')
+            node.handlers[method] = handler
+
+        return self
+
+    def match(self, method, path):
+        """Return (handler, path parameters), or raise NotFound / MethodNotAllowed."""
+        if self._root is None:
+            self.compile()
+
+        handler = self._static.get((method, path))
+        if handler is not None:
+            return handler, {}
+
+        params = {}
+        node = _walk(self._root, _segments(path), 0, params)
+        if node is not None:
+            handler = node.handlers.get(method)
+            if handler is not None:
+                return handler, params
+
+        allowed = set(self._static_methods.get(path, ()))
+        if node is not None:
+            allowed.update(node.handlers)
+        if allowed:
+            raise MethodNotAllowed(sorted(allowed))
+        raise NotFound(path)
+
+
+def _segments(path):
+    return path.strip('/').split('/')
+
+
+def _walk(node, segments, index, params):
+    if index == len(segments):
+        return node if node.handlers else None
+
+    segment = segments[index]
+    child = node.children.get(segment)
+    if child is not None:
+        found = _walk(child, segments, index + 1, params)
+        if found is not None:
+            return found
+
+    for name, accepts, convert, child in node.parameters:
+        if accepts(segment):
+            found = _walk(child, segments, index + 1, params)
+            if found is not None:
+                params[name] = convert(segment)
+                return found
+
+    return None